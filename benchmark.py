@@ -0,0 +1,265 @@
+"""Benchmark suite for the simulation and rendering phases of the game
+
+Times Game.update, Game.draw, Mario.update, Goomba.update and Game.draw_hud
+(plus BodyEngine.step with --vectorized) separately on the stock level and on synthetically scaled copies of it, and
+writes the results as JSON, along with how long importing the game and building one takes.
+
+    python benchmark.py --scales 1,10,100 --output bench.json
+    python benchmark.py --baseline bench.json
+    python benchmark.py --both --output bench.json   # scalar and vectorized, compared separately
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+
+GAME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mario_game (1).py")
+
+# Benchmarks never need a real window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+# Keep pygame's banner out of the JSON written to stdout
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+def load_game():
+    """Import the game module from its file"""
+    spec = importlib.util.spec_from_file_location("mario_game", GAME_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+start = time.perf_counter()
+mg = load_game()
+IMPORT_TIME = time.perf_counter() - start
+pygame = mg.pygame
+
+def startup():
+    """Seconds to import the game and to build a game with its sprite art drawn or loaded from disk"""
+    timings = {"import_s": IMPORT_TIME}
+    directory = mg.ASSETS.directory
+    # The first game also starts the display and fills the asset cache
+    for name, cache in (("first_game_s", directory), ("game_drawn_s", None),
+                        ("game_cached_s", directory)):
+        mg.ASSETS.directory = cache
+        mg.ATLAS.surface = None
+        mg.Mario.frames.clear()
+        start = time.perf_counter()
+        mg.Game(headless=True)
+        timings[name] = time.perf_counter() - start
+    mg.ASSETS.directory = directory
+    return timings
+
+def scale_level(game, factor):
+    """Repeat the stock level factor times to the right"""
+    stock_width = game.level_width
+    ground = game.platforms[0]
+    platforms = game.platforms[1:]
+    question_blocks = list(game.question_blocks)
+    bricks = list(game.bricks)
+    pipes = list(game.pipes)
+    coins = list(game.coin_sprites)
+    goombas = [entry[2] for entry in game.activation.dormant]
+    
+    for copy in range(1, factor):
+        dx = copy * stock_width
+        segment = mg.Ground(ground.rect.x + dx, ground.rect.y,
+                            ground.rect.width, ground.rect.height)
+        game.platforms.append(segment)
+        game.collision_grid.add(segment)
+        game.static_layer.add(segment)
+        
+        for ledge in platforms:
+            sprite = mg.Ground(ledge.rect.x + dx, ledge.rect.y,
+                               ledge.rect.width, ledge.rect.height)
+            game.platforms.append(sprite)
+            game.collision_grid.add(sprite)
+            game.static_layer.add(sprite)
+        for block in question_blocks:
+            sprite = mg.QuestionBlock(block.rect.x + dx, block.rect.y, game.events,
+                                     block.item_type)
+            game.question_blocks.add(sprite)
+            game.collision_grid.add(sprite, mg.BLOCKS)
+            game.static_layer.add(sprite)
+        for brick in bricks:
+            sprite = mg.Brick(brick.rect.x + dx, brick.rect.y, game.events)
+            game.bricks.add(sprite)
+            game.collision_grid.add(sprite, mg.BLOCKS)
+            game.static_layer.add(sprite)
+        for pipe in pipes:
+            sprite = mg.Pipe(pipe.rect.x + dx, pipe.rect.y, pipe.rect.height)
+            game.pipes.add(sprite)
+            game.collision_grid.add(sprite)
+            game.static_layer.add(sprite)
+        for coin in coins:
+            sprite = mg.Coin(coin.rect.x + dx, coin.rect.y)
+            game.coin_sprites.add(sprite)
+            game.all_sprites.add(sprite)
+        for goomba in goombas:
+            sprite = mg.Goomba(goomba.rect.x + dx, goomba.rect.y)
+            game.activation.add(sprite, game.enemies, game.all_sprites)
+    
+    game.level_width = stock_width * factor
+    game.camera = mg.Camera(game.level_width, mg.SCREEN_HEIGHT)
+    # The sprite index keys the flag on its left edge, so take it out while it moves
+    game.all_sprites.remove(game.flag)
+    game.flag.rect.x = game.level_width - 200
+    game.all_sprites.add(game.flag)
+    game.static_layer.bake_all()
+
+def build_game(factor, vectorized=False):
+    """Build a headless game on a level scaled by factor"""
+    game = mg.Game(headless=True, input_source=mg.ScriptedInput(mg.DEMO_SCRIPT),
+                   vectorized=vectorized)
+    if factor > 1:
+        scale_level(game, factor)
+    return game
+
+def count_entities(game):
+    return {
+        "goombas": len(game.enemies) + len(game.activation.dormant),
+        "coins": len(game.coin_sprites),
+        "bricks": len(game.bricks),
+        "question_blocks": len(game.question_blocks),
+        "platforms": len(game.platforms),
+        "pipes": len(game.pipes),
+        "sprites": len(game.all_sprites),
+    }
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+def time_phase(step, frames, budget):
+    """Time step() for up to frames calls or budget seconds, whichever ends first"""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < frames:
+        start = time.perf_counter()
+        step()
+        samples.append(time.perf_counter() - start)
+        if time.perf_counter() - started > budget:
+            break
+    
+    samples.sort()
+    mean = sum(samples) / len(samples)
+    return {
+        "frames": len(samples),
+        "mean_ms": mean * 1000,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "max_ms": samples[-1] * 1000,
+        "fps": 1 / mean if mean else None,
+    }
+
+def phases(game):
+    """Callables for one frame of each benchmarked phase"""
+    def game_update():
+        game.handle_events()
+        game.update()
+    
+    def mario_update():
+        game.mario.update(game.collision_grid, game.input.get_pressed())
+    
+    def goomba_update():
+        for enemy in game.enemies:
+            enemy.update(game.collision_grid)
+    
+    steps = {
+        "Game.update": game_update,
+        "Game.draw": game.draw,
+        "Mario.update": mario_update,
+        "Goomba.update": goomba_update,
+        "Game.draw_hud": game.draw_hud,
+    }
+    if game.bodies is not None:
+        steps["BodyEngine.step"] = lambda: game.bodies.step(game.collision_grid)
+    return steps
+
+def run_scale(factor, frames, budget, vectorized=False):
+    start = time.perf_counter()
+    game = build_game(factor, vectorized)
+    build_time = time.perf_counter() - start
+    
+    result = {
+        "scale": factor,
+        "vectorized": vectorized,
+        "level_width": game.level_width,
+        "entities": count_entities(game),
+        "build_s": build_time,
+        "phases": {},
+    }
+    for name, step in phases(game).items():
+        result["phases"][name] = time_phase(step, frames, budget)
+    return result
+
+def mode_key(entry):
+    """(scale, vectorized): scalar and vectorized timings are only compared with their own kind"""
+    return entry["scale"], entry.get("vectorized", False)
+
+def compare(results, baseline, tolerance):
+    """Return (scale, vectorized, phase, old, new) for every phase slower than the baseline"""
+    old = {mode_key(entry): entry["phases"] for entry in baseline["results"]}
+    regressions = []
+    for entry in results["results"]:
+        for name, stats in entry["phases"].items():
+            previous = old.get(mode_key(entry), {}).get(name)
+            if previous and stats["mean_ms"] > previous["mean_ms"] * (1 + tolerance):
+                regressions.append(mode_key(entry) + (name, previous["mean_ms"], stats["mean_ms"]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default="1,10,100,1000",
+                        help="comma separated level scale factors")
+    parser.add_argument("--frames", type=int, default=120,
+                        help="frames to time per phase")
+    parser.add_argument("--budget", type=float, default=5.0,
+                        help="maximum seconds to spend timing one phase")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="step moving bodies with the NumPy body engine")
+    parser.add_argument("--both", action="store_true",
+                        help="time every scale both scalar and vectorized")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "frames": args.frames,
+        "startup": startup(),
+        "results": [],
+    }
+    modes = (False, True) if args.both else (args.vectorized,)
+    for factor in (int(scale) for scale in args.scales.split(",")):
+        for vectorized in modes:
+            print(f"scale {factor}x{' vectorized' if vectorized else ''} ...", file=sys.stderr)
+            results["results"].append(run_scale(factor, args.frames, args.budget, vectorized))
+    
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for factor, vectorized, name, before, after in regressions:
+            mode = "vectorized" if vectorized else "scalar"
+            print(f"REGRESSION {factor}x {mode} {name}: {before:.3f}ms -> {after:.3f}ms",
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
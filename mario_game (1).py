@@ -1,14 +1,37 @@
 import pygame
 import sys
+import os
+import time
+import argparse
+import bisect
+import math
 import random
+import statistics
+import struct
+import hashlib
+import types
+import operator
+import mmap
+import zlib
+import csv
+import tracemalloc
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-# Initialize Pygame
-pygame.init()
+try:
+    import numpy as np
+except ImportError:  # Only the vectorized body engine needs NumPy
+    np = None
+
+# Importing starts nothing: Game starts the display and get_font the font module when needed
 
 # Constants
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 FPS = 60
+# Velocities are in pixels per frame at FPS, gravity in pixels per frame per frame
 GRAVITY = 0.8
 TERMINAL_VELOCITY = 15
 
@@ -23,6 +46,1551 @@ QUESTION_YELLOW = (255, 185, 0)
 GROUND_BROWN = (139, 90, 43)
 COIN_GOLD = (255, 215, 0)
 
+# Collision grid
+TILE_SIZE = 32
+TERRAIN = 1  # Ground, platforms and pipes: solid for everything
+BLOCKS = 2   # Question blocks and bricks: solid for Mario only
+
+# Activation window
+ACTIVATION_MARGIN = 128  # Entities wake up this far beyond the edge of the screen
+PARK_MARGIN = 512        # and go back to sleep once they are this far away
+SQUASH_FRAMES = 30       # Squashed goombas disappear after half a second
+
+# Timers, in frames at FPS; the timer wheel turns them into simulation steps
+CLOCK_FRAMES = 60        # One second off the level clock
+INVINCIBLE_FRAMES = 120  # Invincibility after getting hit
+STAR_FRAMES = 600        # Star power
+FIREBALL_COOLDOWN = 20   # Between shots
+FIREBALL_LIFETIME = 180  # Before a fireball burns out
+
+# Animation, as a function of the frame clock: frames each pose or color is shown
+COIN_BOB_FRAMES = 3      # Coins bob a pixel this often
+COIN_BOB_HEIGHT = 5      # up and down this far
+STAR_COLOR_FRAMES = 5
+
+# Timer wheel: WHEEL_SLOTS steps a level, each level WHEEL_SLOTS times the span of the one below
+WHEEL_BITS = 6
+WHEEL_SLOTS = 1 << WHEEL_BITS
+WHEEL_LEVELS = 3         # Over an hour at FPS; longer timers wait at the top and cascade again
+
+# Fixed-timestep loop
+SIM_RATE = FPS           # Simulation steps per second; each step covers FPS / rate frames of physics
+MAX_CATCHUP_STEPS = 5    # Steps allowed per rendered frame before falling behind is dropped
+
+# Static terrain is pre-baked into chunks this wide
+CHUNK_WIDTH = 512
+CHUNK_COLORKEY = (255, 0, 255)  # Stands in for the sky in baked chunks; no terrain uses it
+
+class ScriptedKeys(frozenset):
+    """Set of held keys that can be indexed like pygame.key.get_pressed()"""
+    def __getitem__(self, key):
+        return key in self
+
+class KeyboardInput:
+    """Input source that reads the real keyboard"""
+    def get_pressed(self):
+        return pygame.key.get_pressed()
+    
+    def advance(self):
+        """Key presses arrive through the event queue, so nothing to report"""
+        return ()
+
+class ScriptedInput:
+    """Input source that plays back a script of held keys, one entry per frame"""
+    def __init__(self, script, loop=True):
+        self.script = [ScriptedKeys(keys) for keys in script]
+        self.loop = loop
+        self.frame = 0
+        self.held = ScriptedKeys()
+    
+    def get_pressed(self):
+        return self.held
+    
+    def advance(self):
+        """Move to the next frame and return the keys pressed on it"""
+        previous = self.held
+        if self.frame < len(self.script):
+            self.held = self.script[self.frame]
+        elif self.loop and self.script:
+            self.held = self.script[self.frame % len(self.script)]
+        else:
+            self.held = ScriptedKeys()
+        self.frame += 1
+        return self.held - previous
+
+# Run right and hop every 40 frames
+DEMO_SCRIPT = [{pygame.K_RIGHT}] * 30 + [{pygame.K_RIGHT, pygame.K_SPACE}] * 10
+
+# Input logs: per-frame held and pressed keys, bit-packed and run-length encoded
+RECORDED_KEYS = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_SPACE, pygame.K_UP,
+                 pygame.K_x, pygame.K_LCTRL)
+INPUT_MAGIC = b"MINP"
+INPUT_VERSION = 2
+INPUT_HEADER = struct.Struct("<4sHBxIIII")  # magic, version, vectorized, sim rate, frames,
+                                            # interval, checksum count; then the level name
+INPUT_RUN = struct.Struct("<HH")            # run length, frame code
+CHECKSUM_INTERVAL = 60  # Frames between state checksums
+
+class InputLog:
+    """Keys held and pressed on every frame of a run, with state checksums at intervals"""
+    def __init__(self, level, vectorized=False, interval=CHECKSUM_INTERVAL, sim_rate=SIM_RATE):
+        self.level = level
+        self.vectorized = vectorized
+        self.interval = interval
+        self.sim_rate = sim_rate  # Steps per second the run was simulated at
+        self.codes = []      # One per frame: held keys in the low bits, presses above them
+        self.checksums = []  # State at the start of every interval-th frame
+    
+    @staticmethod
+    def encode(held, pressed):
+        code = 0
+        for bit, key in enumerate(RECORDED_KEYS):
+            if held[key]:
+                code |= 1 << bit
+            if key in pressed:
+                code |= 1 << (bit + len(RECORDED_KEYS))
+        return code
+    
+    @staticmethod
+    def decode(code):
+        """(held keys, pressed keys) for a frame code"""
+        held = ScriptedKeys(key for bit, key in enumerate(RECORDED_KEYS) if code >> bit & 1)
+        pressed = [key for bit, key in enumerate(RECORDED_KEYS)
+                   if code >> (bit + len(RECORDED_KEYS)) & 1]
+        return held, pressed
+    
+    def record(self, game, held, pressed):
+        """Log one frame, checksumming the state first when one is due"""
+        if len(self.codes) % self.interval == 0:
+            self.checksums.append(game.state_checksum())
+        self.codes.append(self.encode(held, pressed))
+    
+    def save(self, path):
+        runs = []
+        for code in self.codes:
+            if runs and runs[-1][1] == code and runs[-1][0] < 0xFFFF:
+                runs[-1][0] += 1
+            else:
+                runs.append([1, code])
+        
+        name = self.level.encode()
+        with open(path, "wb") as f:
+            f.write(INPUT_HEADER.pack(INPUT_MAGIC, INPUT_VERSION, self.vectorized, self.sim_rate,
+                                      len(self.codes), self.interval, len(self.checksums)))
+            f.write(struct.pack("<H", len(name)) + name)
+            f.write(struct.pack(f"<{len(self.checksums)}I", *self.checksums))
+            f.write(b"".join(INPUT_RUN.pack(*run) for run in runs))
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, vectorized, sim_rate, frames, interval, checksums = \
+            INPUT_HEADER.unpack_from(data)
+        if magic != INPUT_MAGIC or version != INPUT_VERSION:
+            raise ValueError(f"{path}: not a version {INPUT_VERSION} input log")
+        offset = INPUT_HEADER.size
+        (length,) = struct.unpack_from("<H", data, offset)
+        offset += 2
+        log = cls(data[offset:offset + length].decode(), bool(vectorized), interval, sim_rate)
+        offset += length
+        log.checksums = list(struct.unpack_from(f"<{checksums}I", data, offset))
+        offset += checksums * 4
+        for count, code in INPUT_RUN.iter_unpack(data[offset:]):
+            log.codes.extend([code] * count)
+        if len(log.codes) != frames:
+            raise ValueError(f"{path}: truncated input log")
+        return log
+
+class ReplayInput:
+    """Input source that plays back an InputLog exactly, presses included"""
+    def __init__(self, log):
+        self.frames = {code: InputLog.decode(code) for code in set(log.codes)}
+        self.codes = log.codes
+        self.frame = 0
+        self.held = ScriptedKeys()
+    
+    def get_pressed(self):
+        return self.held
+    
+    def advance(self):
+        """Move to the next logged frame and return the keys pressed on it"""
+        if self.frame >= len(self.codes):
+            self.held = ScriptedKeys()
+            return ()
+        self.held, pressed = self.frames[self.codes[self.frame]]
+        self.frame += 1
+        return pressed
+
+class ActionInput:
+    """Input source driven by an action: a bitmask over RECORDED_KEYS of the keys to hold"""
+    keys = [ScriptedKeys(key for bit, key in enumerate(RECORDED_KEYS) if action >> bit & 1)
+            for action in range(1 << len(RECORDED_KEYS))]
+    
+    def __init__(self):
+        self.action = 0
+        self.held = ScriptedKeys()
+    
+    def get_pressed(self):
+        return self.held
+    
+    def advance(self):
+        """Hold the current action's keys and return the ones newly pressed"""
+        previous = self.held
+        self.held = self.keys[self.action]
+        return self.held - previous
+
+# Opening a font is slow, so every caller shares one per size
+FONTS = {}
+
+def get_font(size):
+    """Shared default font at the given size"""
+    font = FONTS.get(size)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = FONTS[size] = pygame.font.Font(None, size)
+    return font
+
+class TextCache:
+    """Rendered text that is only re-rendered when its value changes"""
+    def __init__(self, font_size):
+        self.font_size = font_size
+        self.surfaces = {}
+    
+    def render(self, template, value=None, color=WHITE):
+        """Surface for template.format(value)"""
+        key = (template, color)
+        cached = self.surfaces.get(key)
+        if cached is None or cached[0] != value:
+            text = template if value is None else template.format(value)
+            surface = get_font(self.font_size).render(text, True, color)
+            cached = self.surfaces[key] = (value, surface)
+        return cached[1]
+
+# Question marks on blocks
+BLOCK_TEXT = TextCache(28)
+
+# Baked sprite art is kept here between runs
+ASSET_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+ASSET_MAGIC = b"MART"
+ASSET_VERSION = 1
+ASSET_HEADER = struct.Struct("<4sHxxI")  # magic, version, surface count
+ASSET_SURFACE = struct.Struct("<HH")     # width, height; RGBA pixels follow, uncompressed to load fast
+
+def is_plain(value):
+    """Data whose repr is the same in every process"""
+    if isinstance(value, (tuple, frozenset)):
+        return all(is_plain(item) for item in value)
+    return value is None or isinstance(value, (int, float, str, bytes, range))
+
+def feed_code(digest, code, namespace):
+    """Hash what a function draws: its bytecode, constants and the plain-data globals it reads
+
+    Line numbers and file names are left out, so moving code around keeps its cache.
+    """
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            feed_code(digest, const, namespace)
+        elif isinstance(const, frozenset):
+            digest.update(repr(sorted(map(repr, const))).encode())
+        else:
+            digest.update(repr(const).encode())
+    for name in code.co_names:
+        digest.update(name.encode())
+        value = namespace.get(name)
+        if is_plain(value):
+            digest.update(repr(value).encode())
+
+class AssetCache:
+    """Baked surfaces on disk, keyed by a hash of the code that draws them
+
+    A change to the drawing code changes the key, so stale art is never loaded.
+    Unreadable or unwritable files just mean drawing from scratch.
+    """
+    def __init__(self, directory=ASSET_CACHE_DIR):
+        self.directory = directory  # None turns the cache off
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(functions, *data):
+        """Digest of the functions' code and the data they draw from, for this pygame version"""
+        digest = hashlib.sha256(pygame.version.ver.encode())
+        for function in functions:
+            function = getattr(function, "__func__", function)
+            feed_code(digest, function.__code__, function.__globals__)
+        digest.update(repr(data).encode())
+        return digest.hexdigest()[:16]
+    
+    def path(self, name, key):
+        return os.path.join(self.directory, f"{name}-{key}.bin")
+    
+    def load(self, name, key):
+        """The surfaces saved under name and key, or None"""
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(name, key), "rb") as file:
+                data = file.read()
+            magic, version, count = ASSET_HEADER.unpack_from(data)
+            if magic != ASSET_MAGIC or version != ASSET_VERSION:
+                raise ValueError("not a current asset file")
+            surfaces = []
+            offset = ASSET_HEADER.size
+            for _ in range(count):
+                width, height = ASSET_SURFACE.unpack_from(data, offset)
+                offset += ASSET_SURFACE.size
+                length = width * height * 4
+                if offset + length > len(data):
+                    raise ValueError("truncated asset file")
+                surfaces.append(pygame.image.frombytes(data[offset:offset + length], (width, height), "RGBA"))
+                offset += length
+        except (OSError, ValueError, struct.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return surfaces
+    
+    def save(self, name, key, surfaces):
+        """Store surfaces under name and key, replacing art saved for older code"""
+        if self.directory is None:
+            return
+        parts = [ASSET_HEADER.pack(ASSET_MAGIC, ASSET_VERSION, len(surfaces))]
+        for surface in surfaces:
+            parts.append(ASSET_SURFACE.pack(*surface.get_size()))
+            parts.append(pygame.image.tobytes(surface, "RGBA"))
+        path = self.path(name, key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for old in os.listdir(self.directory):
+                if old.startswith(name + "-") and old != os.path.basename(path):
+                    os.remove(os.path.join(self.directory, old))
+            # Written aside and renamed, so worker processes starting together never read half a file
+            partial = f"{path}.{os.getpid()}.tmp"
+            with open(partial, "wb") as file:
+                file.write(b"".join(parts))
+            os.replace(partial, path)
+        except OSError:
+            pass
+
+ASSETS = AssetCache()
+
+ATLAS_WIDTH = 256
+
+class SpriteAtlas:
+    """Every animation frame of the ATLAS_CLASSES, drawn once into one shared surface
+
+    Built on first use, in the display's pixel format once there is a display.
+    Sprites show subsurfaces of it instead of drawing their own. Each class
+    lists its frame keys in atlas_frames, its frame_size, and a static
+    draw_frame(image, frame).
+    """
+    def __init__(self, width=ATLAS_WIDTH):
+        self.width = width
+        self.surface = None
+        self.frames = {}  # (class, frame) -> subsurface
+    
+    def get(self, cls, frame):
+        if self.surface is None:
+            self.build()
+        return self.frames[cls, frame]
+    
+    def layout(self):
+        """Shelf-pack every frame, tallest first: ((class, frame) -> rect, atlas height)"""
+        keys = [(cls, frame) for cls in ATLAS_CLASSES for frame in cls.atlas_frames]
+        keys.sort(key=lambda key: -key[0].frame_size[1])
+        rects = {}
+        x = y = shelf = 0
+        for cls, frame in keys:
+            width, height = cls.frame_size
+            if x + width > self.width:
+                x, y, shelf = 0, y + shelf, 0
+            rects[cls, frame] = pygame.Rect(x, y, width, height)
+            x += width
+            shelf = max(shelf, height)
+        return rects, y + shelf
+    
+    def key(self):
+        """AssetCache key covering every frame's drawing code and the layout"""
+        functions = [cls.draw_frame for cls in ATLAS_CLASSES] + [SpriteAtlas.layout, SpriteAtlas.build]
+        data = [(cls.__name__, cls.frame_size, list(cls.atlas_frames), getattr(cls, "colors", None))
+                for cls in ATLAS_CLASSES]
+        return ASSETS.key(functions, data, self.width, BLOCK_TEXT.font_size)
+    
+    def build(self):
+        """Load the atlas from the asset cache, or draw it and cache it"""
+        rects, height = self.layout()
+        key = self.key()
+        cached = ASSETS.load("atlas", key)
+        if cached:
+            surface = cached[0]
+        else:
+            surface = pygame.Surface((self.width, height), pygame.SRCALPHA)
+            for (cls, frame), rect in rects.items():
+                cls.draw_frame(surface.subsurface(rect), frame)
+            ASSETS.save("atlas", key, [surface])
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+        self.surface = surface
+        self.frames = {key: surface.subsurface(rect) for key, rect in rects.items()}
+
+ATLAS = SpriteAtlas()
+
+class CollisionGrid:
+    """Tile-aligned map of static terrain, so collisions only test nearby cells"""
+    def __init__(self, cell_size=TILE_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}
+        self.next_order = 0
+        self.version = 0  # Bumped on every change, so caches of the grid know to refresh
+        self.tests = 0    # Rects handed out for collision tests, for the profiler to collect
+    
+    def cell_range(self, rect):
+        """Cells covered by a rect"""
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+    
+    def add(self, sprite, layer=TERRAIN):
+        """Add a sprite; query results keep the order sprites were added in"""
+        entry = (self.next_order, layer, sprite)
+        self.next_order += 1
+        self.insert(entry)
+    
+    def insert(self, entry):
+        self.version += 1
+        sprite = entry[2]
+        cells = list(self.cell_range(sprite.rect))
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(entry)
+        self.entries[sprite] = (entry, cells)
+    
+    def remove(self, sprite):
+        """Remove a sprite, e.g. a broken brick"""
+        self.version += 1
+        entry, cells = self.entries.pop(sprite)
+        for cell in cells:
+            bucket = self.cells[cell]
+            bucket.remove(entry)
+            if not bucket:
+                del self.cells[cell]
+        return entry
+    
+    def move(self, sprite):
+        """Refresh a sprite's cells after its rect changed, e.g. a bouncing block"""
+        self.insert(self.remove(sprite))
+    
+    def query(self, rect, layers=TERRAIN | BLOCKS):
+        """Sprites in the cells a rect overlaps, in the order they were added"""
+        found = {}
+        cells = self.cells
+        for cell in self.cell_range(rect):
+            for order, layer, sprite in cells.get(cell, ()):
+                if layer & layers:
+                    found[order] = sprite
+        self.tests += len(found)
+        if len(found) < 2:
+            return list(found.values())
+        return [found[order] for order in sorted(found)]
+
+class SpriteIndex(pygame.sprite.Group):
+    """Sprite group indexed by x-extent, so drawing only visits what is on screen"""
+    def __init__(self, *sprites):
+        # Sprites without a horizontal velocity never move sideways and stay
+        # sorted by left edge; the rest are checked individually
+        self.still = []
+        self.movers = {}
+        self.order = {}
+        self.keys = {}  # Still sprite -> (left, order) it is filed under, even if its rect moved since
+        self.next_order = 0
+        self.widest = 0
+        super().__init__(*sprites)
+    
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        order = self.next_order
+        self.next_order += 1
+        self.order[sprite] = order
+        if hasattr(sprite, "velocity_x"):
+            self.movers[sprite] = None
+        else:
+            key = (sprite.rect.left, order)
+            self.keys[sprite] = key
+            bisect.insort(self.still, key + (sprite,))
+            self.widest = max(self.widest, sprite.rect.width)
+    
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        del self.order[sprite]
+        if sprite in self.movers:
+            del self.movers[sprite]
+        else:
+            key = self.keys.pop(sprite)
+            index = bisect.bisect_left(self.still, key)
+            assert self.still[index][:2] == key, "sprite index out of step"
+            del self.still[index]
+    
+    def visible(self, left, right):
+        """Sprites overlapping the x range, in the order they were added"""
+        still = self.still
+        start = bisect.bisect_left(still, (left - self.widest,))
+        end = bisect.bisect_left(still, (right,))
+        found = [sprite for _, _, sprite in still[start:end] if sprite.rect.right > left]
+        for sprite in self.movers:
+            if sprite.rect.right > left and sprite.rect.left < right:
+                found.append(sprite)
+        found.sort(key=self.order.__getitem__)
+        return found
+
+# Broadphase kinds; pairs list the lower kind first
+# Coins never move, so they stay out of the sweep and are looked up by x instead
+KIND_MARIO, KIND_ENEMY, KIND_FIREBALL, KIND_MUSHROOM, KIND_FIRE_FLOWER, KIND_STAR, KIND_ONEUP = range(7)
+PICKUP_KINDS = (KIND_MUSHROOM, KIND_FIRE_FLOWER, KIND_STAR, KIND_ONEUP)
+# Which other kinds each kind does something with when they overlap
+INTERACTIONS = {
+    KIND_MARIO: (KIND_ENEMY,) + PICKUP_KINDS,
+    KIND_ENEMY: (KIND_MARIO, KIND_ENEMY, KIND_FIREBALL),
+    KIND_FIREBALL: (KIND_ENEMY,),
+    **{kind: (KIND_MARIO,) for kind in PICKUP_KINDS},
+}
+
+RECT_LEFT = operator.attrgetter("rect.left")
+
+class Broadphase:
+    """Sweep and prune over every moving sprite, finding all overlaps in one pass
+
+    Sprites are kept sorted by left edge from one sweep to the next; they only
+    move a little in between, so re-sorting is close to linear. Each sprite is
+    only tested against kinds it interacts with, so pickups never meet pickups.
+    """
+    def __init__(self):
+        self.kinds = {}   # sprite -> kind
+        self.order = []   # Sprites by left edge as of the last sweep, plus any added since
+        self.stale = False  # Whether order still lists removed sprites
+        self.tests = 0    # Pairs whose extents were compared, for the profiler to collect
+    
+    def add(self, sprite, kind):
+        if sprite not in self.kinds:
+            self.order.append(sprite)
+        self.kinds[sprite] = kind
+    
+    def remove(self, sprite):
+        if self.kinds.pop(sprite, None) is not None:
+            self.stale = True
+    
+    def sweep(self):
+        """{(kind, kind): [(sprite, sprite), ...]} of overlapping sprites that interact"""
+        kinds = self.kinds
+        order = self.order
+        if self.stale:
+            # Drop removed sprites, and the old place of any removed and added back since
+            order = self.order = [sprite for sprite in dict.fromkeys(order) if sprite in kinds]
+            self.stale = False
+        order.sort(key=RECT_LEFT)
+        
+        pairs = {}
+        active = {kind: [] for kind in INTERACTIONS}  # Sprites to the left that may still reach
+        tests = 0
+        for sprite in order:
+            rect = sprite.rect
+            left, top, bottom = rect.left, rect.top, rect.bottom
+            kind = kinds[sprite]
+            for other_kind in INTERACTIONS[kind]:
+                others = active[other_kind]
+                if not others:
+                    continue
+                # Whatever ends before this sprite starts ends before every later one too
+                others = active[other_kind] = [other for other in others if other.rect.right > left]
+                tests += len(others)
+                for other in others:
+                    other_rect = other.rect
+                    if top < other_rect.bottom and bottom > other_rect.top:
+                        if other_kind <= kind:
+                            pairs.setdefault((other_kind, kind), []).append((other, sprite))
+                        else:
+                            pairs.setdefault((kind, other_kind), []).append((sprite, other))
+            active[kind].append(sprite)
+        self.tests += tests
+        return pairs
+
+class KindGroup(pygame.sprite.Group):
+    """Sprite group whose members take part in a Broadphase as one kind"""
+    def __init__(self, broadphase, kind):
+        self.broadphase = broadphase
+        self.kind = kind
+        super().__init__()
+    
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.broadphase.add(sprite, self.kind)
+    
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.broadphase.remove(sprite)
+
+def in_group_order(sprites, group, key=None):
+    """sprites sorted the way group iterates, as spritecollide would have returned them"""
+    if len(sprites) < 2:
+        return sprites
+    index = {sprite: number for number, sprite in enumerate(group)}
+    return sorted(sprites, key=lambda item: index[item if key is None else key(item)])
+
+class ActivationWindow:
+    """Keeps enemies and power-ups dormant until they come near the camera"""
+    def __init__(self, margin=ACTIVATION_MARGIN, park_margin=PARK_MARGIN, engine=None):
+        self.margin = margin
+        self.park_margin = park_margin
+        self.engine = engine  # BodyEngine that moves awake bodies, if any
+        self.dormant = []  # (x, order, sprite, groups), sorted by x
+        self.active = {}   # sprite -> groups
+        self.next_order = 0
+    
+    def add(self, sprite, *groups):
+        """Register a sprite that stays out of its groups until the camera is near"""
+        bisect.insort(self.dormant, (sprite.rect.x, self.next_order, sprite, groups))
+        self.next_order += 1
+    
+    def find(self, sprite):
+        """Index of a dormant sprite, or None"""
+        x = sprite.rect.x
+        for index in range(bisect.bisect_left(self.dormant, (x,)), len(self.dormant)):
+            entry = self.dormant[index]
+            if entry[0] != x:
+                break
+            if entry[2] is sprite:
+                return index
+        return None
+    
+    def __contains__(self, sprite):
+        return sprite in self.active or self.find(sprite) is not None
+    
+    def discard(self, sprite):
+        """Forget a sprite, awake or dormant, e.g. when its part of the level is released"""
+        if self.active.pop(sprite, None) is None:
+            index = self.find(sprite)
+            if index is not None:
+                del self.dormant[index]
+    
+    def spawn(self, sprite, *groups):
+        """Register a sprite that is active straight away, e.g. a fireball"""
+        sprite.add(*groups)
+        self.active[sprite] = groups
+        if self.engine is not None:
+            self.engine.add(sprite)
+    
+    def update(self, left, right):
+        """Wake sprites near the visible x range and park those far from it"""
+        # Wake
+        start = bisect.bisect_left(self.dormant, (left - self.margin,))
+        end = bisect.bisect_left(self.dormant, (right + self.margin,))
+        if start < end:
+            for _, _, sprite, groups in self.dormant[start:end]:
+                self.spawn(sprite, *groups)
+            del self.dormant[start:end]
+        
+        # Park or despawn
+        for sprite, groups in list(self.active.items()):
+            if not sprite.alive():
+                del self.active[sprite]
+            elif sprite.rect.top > SCREEN_HEIGHT:
+                # Fell out of the world
+                sprite.kill()
+                del self.active[sprite]
+            elif (sprite.rect.right < left - self.park_margin or
+                  sprite.rect.left > right + self.park_margin):
+                sprite.kill()
+                del self.active[sprite]
+                # Fireballs are spent once they leave; everything else waits
+                if not isinstance(sprite, Fireball):
+                    self.add(sprite, *groups)
+
+def to_pixel(value):
+    """Nearest whole pixel, halves away from zero, the way pygame.Rect rounds"""
+    return math.floor(value + 0.5) if value >= 0 else math.ceil(value - 0.5)
+
+class SubPixel:
+    """Sprite that moves in fractions of a pixel, with its rect holding the position rounded
+
+    Steps shorter than a frame move less than a pixel, which whole-pixel rects
+    would drop. Anything may still set the rect directly, e.g. to land on a
+    platform; the fine position follows the rect wherever it no longer rounds
+    to it.
+    """
+    fine_x = None
+    fine_y = None
+    
+    def move_x(self, dx):
+        """Move dx pixels across"""
+        x = self.fine_x
+        if x is None or to_pixel(x) != self.rect.x:
+            x = self.rect.x
+        self.fine_x = x + dx
+        self.rect.x = to_pixel(self.fine_x)
+    
+    def move_y(self, dy):
+        """Move dy pixels down"""
+        y = self.fine_y
+        if y is None or to_pixel(y) != self.rect.y:
+            y = self.rect.y
+        self.fine_y = y + dy
+        self.rect.y = to_pixel(self.fine_y)
+    
+    def position(self):
+        """(x, y) to a fraction of a pixel"""
+        x, y = self.fine_x, self.fine_y
+        if x is None or to_pixel(x) != self.rect.x:
+            x = self.rect.x
+        if y is None or to_pixel(y) != self.rect.y:
+            y = self.rect.y
+        return x, y
+
+class Body(SubPixel):
+    """Moving sprite whose velocity and position live in a BodyEngine's arrays while it is attached"""
+    gravity = GRAVITY
+    bounce = 0             # Vertical velocity after landing on terrain
+    turns_at_walls = True
+    engine = None
+    slot = 0
+    
+    @property
+    def velocity_x(self):
+        if self.engine is None:
+            return self._velocity_x
+        return float(self.engine.vx[self.slot])
+    
+    @velocity_x.setter
+    def velocity_x(self, value):
+        if self.engine is None:
+            self._velocity_x = value
+        else:
+            self.engine.vx[self.slot] = value
+    
+    @property
+    def velocity_y(self):
+        if self.engine is None:
+            return self._velocity_y
+        return float(self.engine.vy[self.slot])
+    
+    @velocity_y.setter
+    def velocity_y(self, value):
+        if self.engine is None:
+            self._velocity_y = value
+        else:
+            self.engine.vy[self.slot] = value
+    
+    _fine_x = None
+    _fine_y = None
+    
+    @property
+    def fine_x(self):
+        if self.engine is None:
+            return self._fine_x
+        return float(self.engine.x[self.slot])
+    
+    @fine_x.setter
+    def fine_x(self, value):
+        if self.engine is None:
+            self._fine_x = value
+        else:
+            self.engine.x[self.slot] = value
+    
+    @property
+    def fine_y(self):
+        if self.engine is None:
+            return self._fine_y
+        return float(self.engine.y[self.slot])
+    
+    @fine_y.setter
+    def fine_y(self, value):
+        if self.engine is None:
+            self._fine_y = value
+        else:
+            self.engine.y[self.slot] = value
+    
+    def kill(self):
+        super().kill()
+        if self.engine is not None:
+            self.engine.remove(self)
+
+def expand_ranges(starts, counts, owners=None):
+    """(owner, value) for every value in each range starts[i] .. starts[i] + counts[i]
+
+    Owners default to each range's index. This is how the body engine turns
+    spans of grid columns into flat arrays of pairs without a Python loop.
+    """
+    if owners is None:
+        owners = np.arange(len(starts))
+    owner = np.repeat(owners, counts)
+    offsets = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+def to_pixels(values):
+    """to_pixel() for an array"""
+    return np.copysign(np.floor(np.abs(values) + 0.5), values)
+
+class BodyEngine:
+    """Positions, velocities and flags of every awake body in NumPy arrays, stepped as a batch"""
+    def __init__(self, capacity=256):
+        if np is None:
+            raise RuntimeError("the vectorized body engine needs NumPy")
+        self.count = 0
+        self.sprites = []
+        self.rects = []  # The sprites' rects, in slot order
+        self.terrain = None
+        self.terrain_version = None
+        self.allocate(capacity)
+    
+    def allocate(self, capacity):
+        """Grow every array to capacity, keeping the live bodies"""
+        def grow(old, dtype):
+            new = np.zeros(capacity, dtype)
+            if old is not None:
+                new[:self.count] = old[:self.count]
+            return new
+        
+        self.x = grow(getattr(self, "x", None), np.float64)
+        self.y = grow(getattr(self, "y", None), np.float64)
+        self.w = grow(getattr(self, "w", None), np.float64)
+        self.h = grow(getattr(self, "h", None), np.float64)
+        self.vx = grow(getattr(self, "vx", None), np.float64)
+        self.vy = grow(getattr(self, "vy", None), np.float64)
+        self.gravity = grow(getattr(self, "gravity", None), np.float64)
+        self.bounce = grow(getattr(self, "bounce", None), np.float64)
+        self.turns = grow(getattr(self, "turns", None), np.bool_)
+        self.moving = grow(getattr(self, "moving", None), np.bool_)
+        self.capacity = capacity
+    
+    def add(self, sprite):
+        """Attach a body; from now on its velocity is read from and written to the arrays"""
+        if sprite.engine is self:
+            return
+        if self.count == self.capacity:
+            self.allocate(self.capacity * 2)
+        
+        slot = self.count
+        self.count += 1
+        self.sprites.append(sprite)
+        self.rects.append(sprite.rect)
+        self.x[slot], self.y[slot] = sprite.position()
+        self.w[slot], self.h[slot] = sprite.rect.size
+        self.vx[slot] = getattr(sprite, "_velocity_x", 0)
+        self.vy[slot] = getattr(sprite, "_velocity_y", 0)
+        self.gravity[slot] = sprite.gravity
+        self.bounce[slot] = sprite.bounce
+        self.turns[slot] = sprite.turns_at_walls
+        self.moving[slot] = not getattr(sprite, "squashed", False)
+        sprite.engine = self
+        sprite.slot = slot
+    
+    def remove(self, sprite):
+        """Detach a body, handing its velocity and position back to the sprite"""
+        if sprite.engine is not self:
+            return
+        slot = sprite.slot
+        sprite.engine = None
+        sprite._velocity_x = float(self.vx[slot])
+        sprite._velocity_y = float(self.vy[slot])
+        sprite._fine_x = float(self.x[slot])
+        sprite._fine_y = float(self.y[slot])
+        
+        # Fill the hole with the last body so the arrays stay dense
+        last = self.count - 1
+        moved = self.sprites.pop()
+        rect = self.rects.pop()
+        if slot != last:
+            for array in (self.x, self.y, self.w, self.h, self.vx, self.vy,
+                          self.gravity, self.bounce, self.turns, self.moving):
+                array[slot] = array[last]
+            self.sprites[slot] = moved
+            self.rects[slot] = rect
+            moved.slot = slot
+        self.count = last
+    
+    def freeze(self, sprite):
+        """Stop moving a body without detaching it, e.g. a squashed goomba"""
+        if sprite.engine is self:
+            self.moving[sprite.slot] = False
+    
+    def load_terrain(self, grid):
+        """Edges of every terrain rect in the grid, plus which of them cover each grid column"""
+        rects = [entry[2].rect for entry, _ in grid.entries.values() if entry[1] & TERRAIN]
+        edges = np.array([(r.left, r.top, r.right, r.bottom) for r in rects],
+                         dtype=np.float64).reshape(-1, 4)
+        self.terrain = edges.T
+        self.terrain_version = grid.version
+        
+        # One (column, terrain) pair per column a rect covers, sorted by column
+        size = grid.cell_size
+        first = np.floor_divide(edges[:, 0], size).astype(np.int64)
+        last = np.floor_divide(edges[:, 2] - 1, size).astype(np.int64)
+        terrain, columns = expand_ranges(first, last - first + 1)
+        order = np.argsort(columns, kind="stable")
+        self.columns = columns[order]
+        self.column_terrain = terrain[order]
+    
+    def step(self, grid, dt=1.0):
+        """Apply gravity, integrate dt frames and resolve terrain for every moving body at once"""
+        n = self.count
+        if not n:
+            return
+        if self.terrain_version != grid.version:
+            self.load_terrain(grid)
+        
+        moving = self.moving[:n]
+        x, y = self.x[:n], self.y[:n]
+        w = self.w[:n]
+        vx, vy = self.vx[:n], self.vy[:n]
+        
+        # Gravity and integration, to fractions of a pixel
+        vy += np.where(moving, self.gravity[:n] * dt, 0)
+        np.minimum(vy, TERMINAL_VELOCITY, out=vy)
+        old_x, old_y = x.copy(), y.copy()
+        x[:] = np.where(moving, x + vx * dt, x)
+        y[:] = np.where(moving, y + vy * dt, y)
+        
+        # Each moving body is only tested against terrain sharing a grid column with it
+        size = grid.cell_size
+        bodies = np.flatnonzero(moving)
+        first = np.floor_divide(x[bodies], size).astype(np.int64)
+        last = np.floor_divide(x[bodies] + w[bodies] - 1, size).astype(np.int64)
+        pair_body, column = expand_ranges(first, last - first + 1)
+        start = np.searchsorted(self.columns, column, "left")
+        end = np.searchsorted(self.columns, column, "right")
+        pair_body, at = expand_ranges(start, end - start, pair_body)
+        if len(at):
+            pair_body = bodies[pair_body]
+            pair_terrain = self.column_terrain[at]
+            # Terrain spanning two of a body's columns shows up twice
+            key = np.unique(pair_body * len(self.terrain[0]) + pair_terrain)
+            pair_body, pair_terrain = np.divmod(key, len(self.terrain[0]))
+            self.collide(old_x, old_y, pair_body, pair_terrain)
+            grid.tests += len(pair_body)
+        
+        # Only bodies that moved to another whole pixel need their rects touched
+        self.sync(np.flatnonzero((to_pixels(x) != to_pixels(old_x)) |
+                                 (to_pixels(y) != to_pixels(old_y))))
+    
+    def collide(self, old_x, old_y, bodies, terrain):
+        """Resolve bodies against terrain, given as parallel arrays of candidate pairs"""
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        w, h = self.w[:n], self.h[:n]
+        vx, vy = self.vx[:n], self.vy[:n]
+        left, top, right, bottom = (edge[terrain] for edge in self.terrain)
+        
+        hit = ((x[bodies] < right) & (x[bodies] + w[bodies] > left) &
+               (y[bodies] < bottom) & (y[bodies] + h[bodies] > top))
+        bodies, top = bodies[hit], top[hit]
+        
+        # Land on terrain the body was above last step
+        above = old_y[bodies] + h[bodies] <= top
+        landing = above & (vy[bodies] > 0)
+        floor = np.full(n, np.inf)
+        np.minimum.at(floor, bodies[landing], top[landing])
+        landed = floor < np.inf
+        y[landed] = floor[landed] - h[landed]
+        vy[landed] = self.bounce[:n][landed]
+        
+        # Anything else hit side-on is a wall
+        walled = np.zeros(n, np.bool_)
+        walled[bodies[~above]] = True
+        walled &= self.turns[:n] & (vx != 0)
+        x[walled] = old_x[walled]
+        vx[walled] *= -1
+    
+    def sync(self, slots):
+        """Copy the positions of the given slots back into the sprites' rects"""
+        rects = self.rects
+        xs = to_pixels(self.x[slots]).astype(np.int64).tolist()
+        ys = to_pixels(self.y[slots]).astype(np.int64).tolist()
+        for slot, x, y in zip(slots.tolist(), xs, ys):
+            rects[slot].topleft = (x, y)
+
+class StaticLayer:
+    """Static terrain pre-baked into fixed-width chunk surfaces"""
+    def __init__(self, chunk_width=CHUNK_WIDTH):
+        self.chunk_width = chunk_width
+        self.members = {}  # chunk index -> sprites drawn into it
+        self.spans = {}    # sprite -> chunk indexes it covers
+        self.chunks = {}   # chunk index -> (surface, top)
+        self.dirty = set()
+    
+    def add(self, sprite):
+        first = sprite.rect.left // self.chunk_width
+        last = (sprite.rect.right - 1) // self.chunk_width
+        self.spans[sprite] = range(first, last + 1)
+        for index in self.spans[sprite]:
+            self.members.setdefault(index, []).append(sprite)
+            self.dirty.add(index)
+    
+    def remove(self, sprite):
+        """Take a sprite out of the layer, e.g. a broken brick"""
+        for index in self.spans.pop(sprite):
+            members = self.members[index]
+            members.remove(sprite)
+            if members:
+                self.dirty.add(index)
+            else:
+                # Nothing left, e.g. a streamed chunk was released
+                del self.members[index]
+                self.chunks.pop(index, None)
+                self.dirty.discard(index)
+    
+    def refresh(self, sprite):
+        """Re-bake a sprite that moved or changed its look"""
+        self.remove(sprite)
+        self.add(sprite)
+    
+    def bake(self, index):
+        """Draw one chunk; only as tall as the terrain in it"""
+        members = self.members.get(index)
+        if not members:
+            return None
+        top = max(0, min(sprite.rect.top for sprite in members))
+        bottom = min(SCREEN_HEIGHT, max(sprite.rect.bottom for sprite in members))
+        if bottom <= top:
+            return None
+        
+        # Opaque and colorkeyed rather than per-pixel alpha: terrain pixels are either
+        # solid or sky, and RLE-encoded chunks skip the sky instead of blending it
+        surface = pygame.Surface((self.chunk_width, bottom - top))
+        surface.fill(CHUNK_COLORKEY)
+        left = index * self.chunk_width
+        for sprite in members:
+            x, y = sprite.rect.x - left, sprite.rect.y - top
+            if hasattr(sprite, 'paint'):
+                sprite.paint(surface, x, y)
+            else:
+                surface.blit(sprite.image, (x, y))
+        surface.set_colorkey(CHUNK_COLORKEY, pygame.RLEACCEL)
+        return surface, top
+    
+    def bake_all(self, workers=None):
+        """Bake every changed chunk on a pool of worker threads"""
+        indexes = sorted(self.dirty)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for index, chunk in zip(indexes, pool.map(self.bake, indexes)):
+                self.chunks[index] = chunk
+        self.dirty.clear()
+    
+    def draw(self, screen, offset_x):
+        """Blit the chunks the camera spans, re-baking any that changed; returns the blit count"""
+        first = -offset_x // self.chunk_width
+        last = (SCREEN_WIDTH - offset_x - 1) // self.chunk_width
+        blits = 0
+        for index in range(first, last + 1):
+            if index in self.dirty:
+                self.chunks[index] = self.bake(index)
+                self.dirty.discard(index)
+            chunk = self.chunks.get(index)
+            if chunk:
+                surface, top = chunk
+                screen.blit(surface, (index * self.chunk_width + offset_x, top))
+                blits += 1
+        return blits
+
+class FixedTimestep:
+    """Accumulator that turns elapsed real time into whole simulation steps"""
+    def __init__(self, rate=SIM_RATE, max_steps=MAX_CATCHUP_STEPS, speed=1.0):
+        self.step = 1.0 / rate
+        self.max_steps = max_steps
+        self.speed = speed
+        self.accumulator = 0.0
+        self.dropped = 0
+    
+    def advance(self, elapsed):
+        """Number of steps to run for elapsed seconds of real time"""
+        self.accumulator += elapsed * self.speed
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            # Too far behind to catch up: let the game slow down rather than spiral
+            self.dropped += steps - self.max_steps
+            steps = self.max_steps
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= steps * self.step
+        return steps
+    
+    @property
+    def alpha(self):
+        """How far between the last two simulation states the next frame falls"""
+        return min(1.0, self.accumulator / self.step)
+
+class Timer:
+    """A callback due on one frame of a TimerWheel; schedule() hands it out as the handle"""
+    __slots__ = ("due", "callback", "args", "armed")
+    
+    def __init__(self, due, callback, args):
+        self.due = due
+        self.callback = callback
+        self.args = args
+        self.armed = True  # Cleared once fired or cancelled
+
+class TimerWheel:
+    """Callbacks scheduled some frames ahead, fired on the step they are due
+
+    A hierarchical timing wheel: level 0 has a slot for each of the next
+    WHEEL_SLOTS steps and each level above spans WHEEL_SLOTS slots of the one
+    below. A timer waits in the coarsest level its delay needs and drops down
+    when the level below wraps round to it, so a step only touches the timers
+    due on it, plus a cascade every WHEEL_SLOTS steps. Cancelled timers stay in
+    their slot and are skipped when it comes up.
+    
+    The wheel turns once per simulation step, rate times a second, while
+    delays and time remaining are in frames at FPS, so durations hold at any
+    rate.
+    
+    Owners keep their handles as attributes, which is what checkpoints save:
+    after clear() a restore rearms the handles its restored owners hold.
+    """
+    def __init__(self, now=0, rate=SIM_RATE):
+        self.steps_per_frame = rate / FPS
+        self.clear(now)
+    
+    def clear(self, now=0):
+        """Drop every timer and set the clock to step now"""
+        self.now = now  # The last step advanced to
+        self.levels = [[[] for _ in range(WHEEL_SLOTS)] for _ in range(WHEEL_LEVELS)]
+    
+    @property
+    def frame(self):
+        """The clock in frames at FPS, which animations are timed in"""
+        return int(self.now / self.steps_per_frame)
+    
+    def insert(self, timer):
+        # Offsets count from the step advance() fires next
+        base = self.now + 1
+        due = max(timer.due, base)
+        offset = due - base
+        for level, slots in enumerate(self.levels):
+            shift = WHEEL_BITS * level
+            if offset >> (shift + WHEEL_BITS) == 0:
+                break
+        else:
+            # Further off than the wheel reaches: park it as far out as it goes
+            due = base + (1 << (shift + WHEEL_BITS)) - 1
+        slots[(due >> shift) & (WHEEL_SLOTS - 1)].append(timer)
+    
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) delay frames from now; returns the Timer as a handle"""
+        steps = round(delay * self.steps_per_frame)
+        timer = Timer(self.now + max(steps, 1), callback, args)
+        self.insert(timer)
+        return timer
+    
+    def cancel(self, timer):
+        """Stop a timer from firing; returns None, for clearing the handle it came from"""
+        if timer is not None:
+            timer.armed = False
+        return None
+    
+    def reschedule(self, timer, delay, callback, *args):
+        """schedule() in place of timer, which is cancelled"""
+        self.cancel(timer)
+        return self.schedule(delay, callback, *args)
+    
+    def remaining(self, timer):
+        """Frames until timer fires, rounded up, or 0 if it is None or done"""
+        if timer is None or not timer.armed:
+            return 0
+        return math.ceil(max(0, timer.due - self.now) / self.steps_per_frame)
+    
+    def release(self, *owners):
+        """Cancel every timer the owners hold, before their state is overwritten"""
+        for owner in owners:
+            for value in vars(owner).values():
+                if isinstance(value, Timer):
+                    value.armed = False
+    
+    def rearm(self, *owners):
+        """Put back every timer still pending that the owners hold, after their state is restored"""
+        for owner in owners:
+            for value in vars(owner).values():
+                if isinstance(value, Timer) and value.due > self.now:
+                    value.armed = True
+                    self.insert(value)
+    
+    def advance(self):
+        """Move on a step and fire every timer due on it"""
+        step = self.now + 1
+        
+        # Each time a level wraps round, the slot it reaches in the level above drops a level
+        level = 0
+        while (step >> WHEEL_BITS * level) & (WHEEL_SLOTS - 1) == 0 and level + 1 < WHEEL_LEVELS:
+            level += 1
+            slots = self.levels[level]
+            index = (step >> WHEEL_BITS * level) & (WHEEL_SLOTS - 1)
+            timers, slots[index] = slots[index], []
+            for timer in timers:
+                if timer.armed:
+                    self.insert(timer)
+        
+        self.now = step
+        slots = self.levels[0]
+        index = step & (WHEEL_SLOTS - 1)
+        timers, slots[index] = slots[index], []
+        for timer in timers:
+            # A timer rearmed by a restore may be in the wheel twice; it fires once
+            if timer.armed:
+                timer.armed = False
+                timer.callback(*timer.args)
+
+class EventBus:
+    """Typed events, queued as they are published and handed to their subscribers once a frame
+
+    Publishers only queue, so whatever they are in the middle of, e.g.
+    Mario's collision loop, finishes before anything reacts. Handlers are
+    keyed by event class.
+    """
+    def __init__(self):
+        self.handlers = {}  # Event class -> handlers, in subscription order
+        self.queue = []
+    
+    def subscribe(self, kind, handler):
+        self.handlers.setdefault(kind, []).append(handler)
+    
+    def publish(self, event):
+        self.queue.append(event)
+    
+    def dispatch(self):
+        """Hand every queued event to its handlers, and any they publish in turn"""
+        while self.queue:
+            queue, self.queue = self.queue, []
+            for event in queue:
+                for handler in self.handlers.get(type(event), ()):
+                    handler(event)
+    
+    def clear(self):
+        """Forget queued events, e.g. ones from before a restore"""
+        self.queue = []
+
+class BlockHit:
+    """A question block was hit from below and gives up its item"""
+    __slots__ = ("block", "item")
+    
+    def __init__(self, block, item):
+        self.block = block
+        self.item = item
+
+class BrickBroken:
+    """A brick was broken from below"""
+    __slots__ = ("brick",)
+    
+    def __init__(self, brick):
+        self.brick = brick
+
+class FrameStats:
+    """Frame-pacing samples, so simulation cost can be told apart from display cost"""
+    def __init__(self):
+        self.intervals = []  # Seconds between presented frames
+        self.sim_times = []  # Seconds spent simulating per frame
+        self.draw_times = []  # Seconds spent drawing per frame
+        self.steps = 0
+    
+    def record(self, interval, steps, sim_time, draw_time):
+        self.intervals.append(interval)
+        self.sim_times.append(sim_time)
+        self.draw_times.append(draw_time)
+        self.steps += steps
+    
+    def summary(self, dropped=0):
+        """Frame time, jitter and per-phase cost in milliseconds"""
+        if not self.intervals:
+            return {}
+        intervals = sorted(self.intervals)
+        return {
+            "frames": len(intervals),
+            "steps": self.steps,
+            "dropped_steps": dropped,
+            "frame_ms": statistics.fmean(intervals) * 1000,
+            "frame_p99_ms": intervals[min(len(intervals) - 1, int(len(intervals) * 0.99))] * 1000,
+            "jitter_ms": statistics.pstdev(intervals) * 1000,
+            "sim_ms": statistics.fmean(self.sim_times) * 1000,
+            "draw_ms": statistics.fmean(self.draw_times) * 1000,
+        }
+    
+    def report(self, dropped=0):
+        summary = self.summary(dropped)
+        if summary:
+            print(f"{summary['frames']} frames, {summary['steps']} steps "
+                  f"({summary['dropped_steps']} dropped): "
+                  f"frame {summary['frame_ms']:.2f}ms (p99 {summary['frame_p99_ms']:.2f}ms, "
+                  f"jitter {summary['jitter_ms']:.2f}ms), "
+                  f"sim {summary['sim_ms']:.2f}ms, draw {summary['draw_ms']:.2f}ms")
+
+# Per-phase profiling: Game.update and Game.draw lap the profiler after each of these
+PROFILE_PHASES = ("input", "timer", "mario", "camera", "events", "blocks", "bodies", "enemies",
+                  "items", "pickups", "enemy_hits",
+                  "sky", "clouds", "terrain", "sprites", "hud", "overlay", "flip")
+PROFILE_COUNTERS = ("collision_tests", "blits")
+PROFILE_WINDOW = 300          # Frames the rolling percentiles cover
+PROFILE_OVERLAY_REFRESH = 30  # Frames between re-rendering the overlay text
+
+class FrameProfiler:
+    """Per-frame phase timings and counters, shown as an overlay and streamed to CSV
+
+    A frame runs from one start() to the next; lap(phase) charges the time since
+    the previous lap to phase. Games without a profiler skip all of this.
+    """
+    def __init__(self, csv_path=None, overlay=True, window=PROFILE_WINDOW):
+        self.overlay = overlay
+        self.times = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.counts = dict.fromkeys(PROFILE_COUNTERS, 0)
+        self.history = {name: deque(maxlen=window)
+                        for name in ("frame",) + PROFILE_PHASES + PROFILE_COUNTERS}
+        self.frames = 0
+        self.frame_start = None  # Until start() begins the first frame
+        self.last = time.perf_counter()
+        self.lines = []  # Rendered overlay rows
+        self.backdrop = None  # Translucent panel behind them, rebuilt when its size changes
+        self.csv_file = None
+        if csv_path:
+            self.csv_file = open(csv_path, "w", newline="")
+            self.csv = csv.writer(self.csv_file)
+            self.csv.writerow(("frame", "frame_ms") + tuple(f"{phase}_ms" for phase in PROFILE_PHASES)
+                              + PROFILE_COUNTERS)
+    
+    def start(self):
+        """Finish the frame in progress and start timing the next one"""
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.finish(now - self.frame_start)
+        self.frame_start = self.last = now
+    
+    def stop(self):
+        """Finish the frame in progress without starting another, e.g. when a game ends"""
+        if self.frame_start is not None:
+            self.finish(time.perf_counter() - self.frame_start)
+            self.frame_start = None
+    
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.times[phase] += now - self.last
+        self.last = now
+    
+    def count(self, counter, amount):
+        self.counts[counter] += amount
+    
+    def finish(self, total):
+        times, counts, history = self.times, self.counts, self.history
+        history["frame"].append(total)
+        for phase, seconds in times.items():
+            history[phase].append(seconds)
+        for counter, amount in counts.items():
+            history[counter].append(amount)
+        if self.csv_file is not None:
+            self.csv.writerow([self.frames, f"{total * 1000:.4f}"]
+                              + [f"{seconds * 1000:.4f}" for seconds in times.values()]
+                              + list(counts.values()))
+        self.frames += 1
+        self.times = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.counts = dict.fromkeys(PROFILE_COUNTERS, 0)
+    
+    def percentiles(self, name):
+        """(p50, p95, p99) of a phase or counter over the rolling window"""
+        samples = sorted(self.history[name])
+        if not samples:
+            return 0, 0, 0
+        last = len(samples) - 1
+        return tuple(samples[min(last, int(len(samples) * q))] for q in (0.5, 0.95, 0.99))
+    
+    def rows(self):
+        """(name, p50, p95, p99) for the frame, each phase that took time and each counter"""
+        rows = []
+        for name in ("frame",) + PROFILE_PHASES:
+            p50, p95, p99 = self.percentiles(name)
+            if name == "frame" or p99:
+                rows.append((name, p50 * 1000, p95 * 1000, p99 * 1000))
+        for name in PROFILE_COUNTERS:
+            rows.append((name,) + self.percentiles(name))
+        return rows
+    
+    def draw(self, screen):
+        """Blit the overlay, re-rendering its text every PROFILE_OVERLAY_REFRESH frames"""
+        if not self.lines or self.frames % PROFILE_OVERLAY_REFRESH == 0:
+            font = get_font(18)
+            lines = ["{:<16}{:>8}{:>8}{:>8}".format("ms / count", "p50", "p95", "p99")]
+            lines += ["{:<16}{:>8.2f}{:>8.2f}{:>8.2f}".format(*row) for row in self.rows()]
+            self.lines = [font.render(line, True, WHITE) for line in lines]
+        width = max(line.get_width() for line in self.lines) + 12
+        height = len(self.lines) * 16 + 8
+        if self.backdrop is None or self.backdrop.get_size() != (width, height):
+            self.backdrop = pygame.Surface((width, height), pygame.SRCALPHA)
+            self.backdrop.fill((0, 0, 0, 160))
+        screen.blit(self.backdrop, (SCREEN_WIDTH - width - 10, 70))
+        for row, line in enumerate(self.lines):
+            screen.blit(line, (SCREEN_WIDTH - width - 4, 74 + row * 16))
+    
+    def report(self):
+        """Print the rolling percentiles"""
+        print(f"profile of the last {len(self.history['frame'])} of {self.frames} frames:")
+        for name, p50, p95, p99 in self.rows():
+            print(f"  {name:<16}p50 {p50:8.3f}  p95 {p95:8.3f}  p99 {p99:8.3f}")
+    
+    def close(self):
+        self.stop()
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+
+ALLOCATION_WARMUP = 60    # Frames of caches filling up before allocations count
+
+class AllocationTracker:
+    """Allocations each frame makes, by call site, from tracemalloc and a line tracer
+
+    Call frame() once per frame. After warmup frames a trace function follows
+    every line of the game and reads tracemalloc's peak since the line before:
+    if it rose, the line allocated, even if what it made is freed again within
+    the frame. Snapshots only see what is still allocated, which misses exactly
+    that garbage. Code in other files is charged to the game line calling it.
+    Debug only: tracing every line slows the game down many times over.
+    """
+    def __init__(self, warmup=ALLOCATION_WARMUP):
+        self.warmup = warmup
+        self.frames = 0
+        self.counted = 0     # Frames seen in full by the tracer
+        self.counting = False
+        self.sites = {}      # (code, line) -> [allocations, bytes] over the counted frames
+        self.peak_bytes = 0  # Summed over counted frames: most allocated above the frame's start
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start()
+        self.filename = AllocationTracker.trace.__code__.co_filename
+        # The tracker's own code, generator expressions included, is not the game's to pay for
+        self.own = set()
+        codes = [function.__code__ for function in vars(AllocationTracker).values()
+                 if isinstance(function, types.FunctionType)]
+        while codes:
+            code = codes.pop()
+            self.own.add(code)
+            codes += [const for const in code.co_consts if isinstance(const, types.CodeType)]
+        self.tracer = self.trace  # One bound method, so handing it back allocates nothing
+        self.site = None  # (code, line) running now; None while nothing is charged
+        self.mark = 0     # Traced memory when it started
+        self.frame_start = 0
+        self.frame_peak = 0
+    
+    def frame(self):
+        """Close the previous frame and start counting the next"""
+        if self.counting:
+            self.peak_bytes += self.frame_peak - self.frame_start
+            self.counted += 1
+        # Tracing only reaches calls made after it starts, so its first frame is partial
+        self.counting = sys.gettrace() is self.tracer
+        if self.frames == self.warmup:
+            sys.settrace(self.tracer)
+        self.frames += 1
+        self.site = None
+        self.mark = self.frame_start = self.frame_peak = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    
+    def trace(self, frame, event, arg):
+        """sys.settrace hook: charge what the last line allocated, then note the next one"""
+        peak = tracemalloc.get_traced_memory()[1]
+        allocated = peak - self.mark
+        if event == "call":
+            # Less the frame object tracing makes for the call; resumed generators
+            # already have theirs, but the line resuming them allocates nothing
+            allocated -= sys.getsizeof(frame)
+        if self.counting and self.site is not None and allocated > 0:
+            site = self.sites.get(self.site)
+            if site is None:
+                site = self.sites[self.site] = [0, 0]
+            site[0] += 1
+            site[1] += allocated
+        self.frame_peak = max(self.frame_peak, peak)
+        
+        code = frame.f_code
+        tracer = self.tracer
+        if event == "call":
+            if code in self.own:
+                self.site = None
+                tracer = None
+            elif code.co_filename != self.filename:
+                tracer = None  # The calling line keeps being charged
+            else:
+                self.site = (code, frame.f_lineno)
+        elif event == "line":
+            self.site = (code, frame.f_lineno)
+        elif event == "return":
+            caller = frame.f_back
+            self.site = (caller.f_code, caller.f_lineno) if caller is not None else None
+        
+        # Free this call's own numbers first and read the mark before resetting,
+        # or either would count against the next line
+        del peak, allocated
+        self.mark = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return tracer
+    
+    def per_frame(self):
+        """(allocations, bytes) per counted frame"""
+        frames = max(1, self.counted)
+        blocks = sum(site[0] for site in self.sites.values())
+        size = sum(site[1] for site in self.sites.values())
+        return blocks / frames, size / frames
+    
+    def top(self, limit=10):
+        """Call sites allocating most often: (site, allocations per frame, bytes per frame)"""
+        frames = max(1, self.counted)
+        ranked = sorted(self.sites.items(), key=lambda item: (-item[1][0], -item[1][1]))
+        return [(f"{os.path.basename(code.co_filename)}:{line}", count / frames, size / frames)
+                for (code, line), (count, size) in ranked[:limit]]
+    
+    def report(self, game=None, limit=10):
+        count, size = self.per_frame()
+        peak = self.peak_bytes / max(1, self.counted)
+        print(f"allocations over {self.counted} frames after {self.warmup} of warm-up: "
+              f"{count:.1f} allocations, {size:.0f} bytes per frame; "
+              f"{peak:.0f} bytes transient peak per frame")
+        for site, site_count, site_size in self.top(limit):
+            print(f"  {site_count:8.2f} allocs {site_size:10.1f} bytes  {site}")
+        if game is not None:
+            print("sprite pools:")
+            for name, stats in game.pool_stats().items():
+                print(f"  {name:<16}" + ", ".join(f"{key} {value}" for key, value in stats.items()))
+            print("surface memory:")
+            for name, (count, size) in sorted(surface_memory(game).items(), key=lambda item: -item[1][1]):
+                print(f"  {name:<16}{count:6} surfaces {size / 1024:10.1f} KiB")
+    
+    def close(self):
+        if sys.gettrace() is self.tracer:
+            sys.settrace(None)
+        if self.started and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+def surface_memory(game):
+    """Pixel memory held by each sprite class and the terrain chunks: name -> (surfaces, bytes)
+
+    Surfaces shared between sprites are counted once, for the first class seen using them.
+    """
+    totals = {}
+    seen = set()
+    
+    def charge(name, surface):
+        if surface is None:
+            return
+        if surface.get_parent() is not None:
+            name, surface = "SpriteAtlas", surface.get_abs_parent()
+        if id(surface) in seen:
+            return
+        seen.add(id(surface))
+        count, size = totals.get(name, (0, 0))
+        totals[name] = (count + 1, size + surface.get_pitch() * surface.get_height())
+    
+    sprites = list(game.all_sprites) + [entry[2] for entry in game.activation.dormant]
+    for sprite in sprites:
+        charge(type(sprite).__name__, sprite.image)
+    for chunk in game.static_layer.chunks.values():
+        if chunk:
+            charge("StaticLayer", chunk[0])
+    charge("Screen", game.screen)
+    return totals
+
 class Camera:
     """Camera that follows the player"""
     def __init__(self, width, height):
@@ -44,9 +1612,9 @@ class Camera:
         
         self.camera = pygame.Rect(x, y, self.width, self.height)
 
-class Mario(pygame.sprite.Sprite):
+class Mario(SubPixel, pygame.sprite.Sprite):
     """Mario player character with authentic physics"""
-    def __init__(self, x, y):
+    def __init__(self, x, y, timers=None):
         super().__init__()
         self.state = "small"  # small, super, fire
         self.width = 32
@@ -72,138 +1640,191 @@ class Mario(pygame.sprite.Sprite):
         self.is_walking = False
         self.is_jumping = False
         
+        # Power-ups and the fireball cooldown end on timers from the game's wheel
+        self.timers = timers if timers is not None else TimerWheel()
+        
         # Invincibility after getting hit
         self.invincible = False
-        self.invincible_timer = 0
+        self.invincible_end = None
         self.star_power = False
-        self.star_timer = 0
+        self.star_end = None
         
         # Fire Mario
         self.can_shoot = False
-        self.fireball_cooldown = 0
+        self.reload_end = None
         
         self.draw_mario()
     
+    @property
+    def invincible_timer(self):
+        """Frames of invincibility left"""
+        return self.timers.remaining(self.invincible_end)
+    
+    @property
+    def star_timer(self):
+        """Frames of star power left"""
+        return self.timers.remaining(self.star_end)
+    
+    @property
+    def fireball_cooldown(self):
+        """Frames until Mario can shoot again"""
+        return self.timers.remaining(self.reload_end)
+    
+    # Baked frames shared by every Mario, keyed by frame_key()
+    frames = {}
+    
+    def frame_key(self):
+        """Everything that changes how Mario looks this frame"""
+        walk_frame = self.animation_frame % 2 if self.is_walking else None
+        stepping = self.is_walking and self.on_ground
+        # Rainbow effect for star power cycles through colors every tenth of a second
+        rainbow = (self.star_timer // 6) % 6 if self.star_power else None
+        return (self.state, self.facing_right, walk_frame, stepping, rainbow)
+    
+    @staticmethod
+    def frame_keys():
+        """Every frame_key() Mario can have"""
+        for state in ("small", "super", "fire"):
+            for facing_right in (True, False):
+                for walk_frame in (None, 0, 1):
+                    for stepping in ((False,) if walk_frame is None else (False, True)):
+                        for rainbow in (None, 0, 1, 2, 3, 4, 5):
+                            yield (state, facing_right, walk_frame, stepping, rainbow)
+    
+    @classmethod
+    def bake_frames(cls):
+        """Render every frame Mario can show, once per process, or load them from the asset cache"""
+        keys = list(cls.frame_keys())
+        cache_key = ASSETS.key([cls.frame_keys, cls.render_frame])
+        images = ASSETS.load("mario", cache_key)
+        if images is None or len(images) != len(keys):
+            images = [cls.render_frame(*key) for key in keys]
+            ASSETS.save("mario", cache_key, images)
+        cls.frames.update(zip(keys, images))
+    
     def draw_mario(self):
-        """Draw Mario sprite"""
-        self.image.fill((0, 0, 0, 0))
-        
+        """Show the baked frame for Mario's current state"""
+        if not Mario.frames:
+            Mario.bake_frames()
+        self.image = Mario.frames[self.frame_key()]
+        self.height = self.image.get_height()
+        self.rect.height = self.height
+    
+    @staticmethod
+    def render_frame(state, facing_right, walk_frame, stepping, rainbow):
+        """Draw one Mario frame"""
         # Determine height based on state
-        if self.state == "super" or self.state == "fire":
-            self.height = 48
+        if state == "super" or state == "fire":
+            height = 48
             hat_y = 2
             face_y = 12
         else:
-            self.height = 32
+            height = 32
             hat_y = 2
             face_y = 10
         
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        self.rect.height = self.height
-        
-        # Rainbow effect for star power
-        if self.star_power:
-            # Cycle through colors
-            rainbow_offset = (pygame.time.get_ticks() // 100) % 6
+        image = pygame.Surface((32, height), pygame.SRCALPHA)
+        is_walking = walk_frame is not None
         
         # Hat (red)
         hat_color = (220, 20, 20)
-        if self.star_power:
+        if rainbow is not None:
             colors = [(255, 0, 0), (255, 165, 0), (255, 255, 0), (0, 255, 0), (0, 0, 255), (138, 43, 226)]
-            hat_color = colors[rainbow_offset]
+            hat_color = colors[rainbow]
         
-        pygame.draw.ellipse(self.image, hat_color, (4, hat_y, 24, 12))
-        pygame.draw.rect(self.image, hat_color, (6, hat_y + 6, 20, 8))
+        pygame.draw.ellipse(image, hat_color, (4, hat_y, 24, 12))
+        pygame.draw.rect(image, hat_color, (6, hat_y + 6, 20, 8))
         
         # Hat logo (M)
-        pygame.draw.circle(self.image, WHITE, (16, hat_y + 6), 4)
+        pygame.draw.circle(image, WHITE, (16, hat_y + 6), 4)
         
         # Face (peach)
-        pygame.draw.ellipse(self.image, (255, 220, 177), (8, face_y, 16, 16))
+        pygame.draw.ellipse(image, (255, 220, 177), (8, face_y, 16, 16))
         
         # Eyes
-        if self.is_walking:
-            offset = (self.animation_frame % 2)
-            pygame.draw.circle(self.image, BLACK, (12, face_y + 6), 2)
-            pygame.draw.circle(self.image, BLACK, (20, face_y + 6), 2)
+        if is_walking:
+            pygame.draw.circle(image, BLACK, (12, face_y + 6), 2)
+            pygame.draw.circle(image, BLACK, (20, face_y + 6), 2)
         else:
-            pygame.draw.circle(self.image, BLACK, (13, face_y + 6), 2)
-            pygame.draw.circle(self.image, BLACK, (19, face_y + 6), 2)
+            pygame.draw.circle(image, BLACK, (13, face_y + 6), 2)
+            pygame.draw.circle(image, BLACK, (19, face_y + 6), 2)
         
         # Nose
-        pygame.draw.circle(self.image, (255, 200, 160), (16, face_y + 10), 2)
+        pygame.draw.circle(image, (255, 200, 160), (16, face_y + 10), 2)
         
         # Mustache
-        pygame.draw.ellipse(self.image, (101, 67, 33), (10, face_y + 11, 12, 5))
+        pygame.draw.ellipse(image, (101, 67, 33), (10, face_y + 11, 12, 5))
         
         # Shirt color (red for normal, white for fire)
-        shirt_color = WHITE if self.state == "fire" else (220, 20, 20)
-        overalls_color = (30, 90, 200) if self.state != "fire" else (220, 20, 20)
+        shirt_color = WHITE if state == "fire" else (220, 20, 20)
+        overalls_color = (30, 90, 200) if state != "fire" else (220, 20, 20)
         
         # Rainbow colors for star power
-        if self.star_power:
-            shirt_color = colors[(rainbow_offset + 2) % 6]
-            overalls_color = colors[(rainbow_offset + 4) % 6]
+        if rainbow is not None:
+            shirt_color = colors[(rainbow + 2) % 6]
+            overalls_color = colors[(rainbow + 4) % 6]
         
         # Body
         body_y = face_y + 16
-        pygame.draw.rect(self.image, shirt_color, (8, body_y, 16, 8))
+        pygame.draw.rect(image, shirt_color, (8, body_y, 16, 8))
         
         # Overalls
-        pygame.draw.rect(self.image, overalls_color, (10, body_y + 4, 12, 12))
+        pygame.draw.rect(image, overalls_color, (10, body_y + 4, 12, 12))
         
         # Buttons
-        pygame.draw.circle(self.image, QUESTION_YELLOW, (13, body_y + 8), 2)
-        pygame.draw.circle(self.image, QUESTION_YELLOW, (19, body_y + 8), 2)
+        pygame.draw.circle(image, QUESTION_YELLOW, (13, body_y + 8), 2)
+        pygame.draw.circle(image, QUESTION_YELLOW, (19, body_y + 8), 2)
         
         # Arms (animated based on walking)
         arm_offset = 0
-        if self.is_walking:
-            arm_offset = 2 if self.animation_frame % 2 == 0 else -2
+        if is_walking:
+            arm_offset = 2 if walk_frame == 0 else -2
         
-        pygame.draw.rect(self.image, shirt_color, (4, body_y + 2 + arm_offset, 4, 10))
-        pygame.draw.rect(self.image, shirt_color, (24, body_y + 2 - arm_offset, 4, 10))
+        pygame.draw.rect(image, shirt_color, (4, body_y + 2 + arm_offset, 4, 10))
+        pygame.draw.rect(image, shirt_color, (24, body_y + 2 - arm_offset, 4, 10))
         
         # Legs (animated)
         leg_y = body_y + 16
-        if self.is_walking and self.on_ground:
-            if self.animation_frame % 2 == 0:
-                pygame.draw.rect(self.image, overalls_color, (10, leg_y, 5, 10))
-                pygame.draw.rect(self.image, overalls_color, (17, leg_y - 2, 5, 12))
+        if stepping:
+            if walk_frame == 0:
+                pygame.draw.rect(image, overalls_color, (10, leg_y, 5, 10))
+                pygame.draw.rect(image, overalls_color, (17, leg_y - 2, 5, 12))
             else:
-                pygame.draw.rect(self.image, overalls_color, (10, leg_y - 2, 5, 12))
-                pygame.draw.rect(self.image, overalls_color, (17, leg_y, 5, 10))
+                pygame.draw.rect(image, overalls_color, (10, leg_y - 2, 5, 12))
+                pygame.draw.rect(image, overalls_color, (17, leg_y, 5, 10))
         else:
-            pygame.draw.rect(self.image, overalls_color, (10, leg_y, 5, 10))
-            pygame.draw.rect(self.image, overalls_color, (17, leg_y, 5, 10))
+            pygame.draw.rect(image, overalls_color, (10, leg_y, 5, 10))
+            pygame.draw.rect(image, overalls_color, (17, leg_y, 5, 10))
         
         # Shoes
         shoe_y = leg_y + 10
-        pygame.draw.ellipse(self.image, (101, 67, 33), (8, shoe_y, 8, 4))
-        pygame.draw.ellipse(self.image, (101, 67, 33), (16, shoe_y, 8, 4))
+        pygame.draw.ellipse(image, (101, 67, 33), (8, shoe_y, 8, 4))
+        pygame.draw.ellipse(image, (101, 67, 33), (16, shoe_y, 8, 4))
         
         # Flip if facing left
-        if not self.facing_right:
-            self.image = pygame.transform.flip(self.image, True, False)
+        if not facing_right:
+            image = pygame.transform.flip(image, True, False)
+        return image
     
-    def handle_input(self):
-        """Handle keyboard input"""
-        keys = pygame.key.get_pressed()
+    def handle_input(self, keys=None, dt=1.0):
+        """Handle keyboard input over dt frames"""
+        if keys is None:
+            keys = pygame.key.get_pressed()
         
         # Horizontal movement
         if keys[pygame.K_LEFT]:
-            self.velocity_x -= self.acceleration
+            self.velocity_x -= self.acceleration * dt
             self.facing_right = False
             self.is_walking = True
         elif keys[pygame.K_RIGHT]:
-            self.velocity_x += self.acceleration
+            self.velocity_x += self.acceleration * dt
             self.facing_right = True
             self.is_walking = True
         else:
             self.is_walking = False
         
         # Apply friction
-        self.velocity_x *= self.friction
+        self.velocity_x *= self.friction ** dt
         
         # Limit speed
         if abs(self.velocity_x) > self.max_speed:
@@ -220,55 +1841,47 @@ class Mario(pygame.sprite.Sprite):
             self.on_ground = False
             self.is_jumping = True
     
-    def shoot_fireball(self):
-        """Shoot a fireball (only if Fire Mario)"""
-        if self.can_shoot and self.fireball_cooldown <= 0:
-            self.fireball_cooldown = 20  # Cooldown between shots
+    def shoot_fireball(self, pool=None):
+        """Shoot a fireball (only if Fire Mario), reusing a spare one from pool if given"""
+        if self.can_shoot and self.reload_end is None:
+            self.reload_end = self.timers.schedule(FIREBALL_COOLDOWN, self.reload)
             direction = 1 if self.facing_right else -1
             offset_x = 20 if self.facing_right else -20
-            return Fireball(self.rect.centerx + offset_x, self.rect.centery, direction)
+            make = Fireball if pool is None else pool.acquire
+            return make(self.rect.centerx + offset_x, self.rect.centery, direction)
         return None
     
-    def update(self, platforms, question_blocks, bricks, pipes):
-        """Update Mario's position and state"""
-        self.handle_input()
+    def update(self, grid, keys=None, dt=1.0):
+        """Update Mario's position and state over a step of dt frames"""
+        self.handle_input(keys, dt)
         
         # Apply gravity
-        self.velocity_y += GRAVITY
+        self.velocity_y += GRAVITY * dt
         if self.velocity_y > TERMINAL_VELOCITY:
             self.velocity_y = TERMINAL_VELOCITY
         
         # Update animation
         if self.is_walking and self.on_ground:
-            self.animation_counter += 1
+            self.animation_counter += dt
             if self.animation_counter >= 8:
                 self.animation_frame += 1
                 self.animation_counter = 0
         
-        # Invincibility timer
-        if self.invincible:
-            self.invincible_timer -= 1
-            if self.invincible_timer <= 0:
-                self.invincible = False
-        
-        # Star power timer
-        if self.star_power:
-            self.star_timer -= 1
-            if self.star_timer <= 0:
-                self.star_power = False
-        
-        # Fireball cooldown
-        if self.fireball_cooldown > 0:
-            self.fireball_cooldown -= 1
-        
         # Horizontal movement and collision
-        self.rect.x += self.velocity_x
-        self.check_collision_x(platforms + question_blocks + bricks + pipes)
+        old_rect = self.rect.copy()
+        self.move_x(self.velocity_x * dt)
+        self.check_collision_x(grid.query(self.rect.union(old_rect)))
         
         # Vertical movement and collision
-        self.rect.y += self.velocity_y
+        old_rect = self.rect.copy()
+        self.move_y(self.velocity_y * dt)
         self.on_ground = False
-        self.check_collision_y(platforms + question_blocks + bricks + pipes)
+        self.check_collision_y(grid.query(self.rect.union(old_rect)))
+        if not self.on_ground and self.velocity_y >= 0:
+            # Steps shorter than a frame may sink less than a pixel into the ground,
+            # which the rect doesn't show: standing on it still counts
+            below = self.rect.move(0, 1)
+            self.on_ground = any(below.colliderect(platform.rect) for platform in grid.query(below))
         
         # Redraw Mario
         self.draw_mario()
@@ -324,7 +1937,7 @@ class Mario(pygame.sprite.Sprite):
             self.rect.bottom = old_bottom
         elif power_type == "star":
             self.star_power = True
-            self.star_timer = 600  # 10 seconds at 60 FPS
+            self.star_end = self.timers.reschedule(self.star_end, STAR_FRAMES, self.end_star_power)
     
     def take_damage(self):
         """Take damage"""
@@ -335,128 +1948,169 @@ class Mario(pygame.sprite.Sprite):
             self.state = "small"
             self.can_shoot = False
             self.invincible = True
-            self.invincible_timer = 120  # 2 seconds at 60 FPS
+            self.invincible_end = self.timers.reschedule(self.invincible_end, INVINCIBLE_FRAMES,
+                                                         self.end_invincibility)
             old_bottom = self.rect.bottom
             self.draw_mario()
             self.rect.bottom = old_bottom
             return False
         else:
             return True  # Mario dies
+    
+    def end_invincibility(self):
+        self.invincible = False
+        self.invincible_end = None
+    
+    def end_star_power(self):
+        self.star_power = False
+        self.star_end = None
+    
+    def reload(self):
+        self.reload_end = None
 
 class Ground(pygame.sprite.Sprite):
-    """Ground/Floor platform"""
+    """Ground/Floor platform, painted straight into the static layer"""
+    strips = {}  # height -> one 16px column of the ground pattern, shared by every piece
+    
     def __init__(self, x, y, width, height):
         super().__init__()
-        self.image = pygame.Surface((width, height))
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-        self.draw()
+        self.rect = pygame.Rect(x, y, width, height)
     
-    def draw(self):
-        # Ground texture
-        self.image.fill(GROUND_BROWN)
-        
-        # Add brick pattern
-        for y in range(0, self.rect.height, 16):
-            for x in range(0, self.rect.width, 16):
-                pygame.draw.rect(self.image, (120, 80, 40), (x, y, 16, 16), 1)
-        
-        # Top grass layer
-        for x in range(0, self.rect.width, 4):
-            pygame.draw.line(self.image, (34, 139, 34), (x, 0), (x + 2, 0), 2)
+    @staticmethod
+    def strip(height):
+        """The ground pattern for one 16px tile column, drawn once per height"""
+        strip = Ground.strips.get(height)
+        if strip is None:
+            strip = pygame.Surface((16, height))
+            
+            # Ground texture
+            strip.fill(GROUND_BROWN)
+            
+            # Add brick pattern
+            for tile_y in range(0, height, 16):
+                pygame.draw.rect(strip, (120, 80, 40), (0, tile_y, 16, 16), 1)
+            
+            # Top grass layer
+            for blade_x in range(0, 16, 4):
+                pygame.draw.line(strip, (34, 139, 34), (blade_x, 0), (blade_x + 2, 0), 2)
+            Ground.strips[height] = strip
+        return strip
+    
+    def paint(self, target, x, y):
+        """Draw the part of the ground that lands on target, with its corner at (x, y)"""
+        clip = target.get_clip()
+        target.set_clip(pygame.Rect(x, y, self.rect.width, self.rect.height).clip(clip))
+        visible = target.get_clip()
+        first = max(0, visible.left - x)
+        last = min(self.rect.width, visible.right - x)
+        
+        # The pattern repeats every tile, so stamp copies of one column
+        strip = Ground.strip(self.rect.height)
+        target.blits([(strip, (x + tile_x, y)) for tile_x in range(first - first % 16, last, 16)],
+                     doreturn=False)
+        
+        target.set_clip(clip)
 
 class QuestionBlock(pygame.sprite.Sprite):
     """Question mark block"""
-    def __init__(self, x, y, item_type="coin"):
+    frame_size = (32, 32)
+    atlas_frames = ("active", "used")
+    
+    def __init__(self, x, y, events, item_type="coin"):
         super().__init__()
         self.width = 32
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height))
+        self.item_type = item_type  # "coin", "mushroom", "fire_flower", "star", "1up"
+        self.events = events  # EventBus told when the block is hit
+        self.is_active = True
+        self.draw()
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
-        self.item_type = item_type  # "coin", "mushroom", "fire_flower", "star", "1up"
-        self.is_active = True
-        self.bounce_offset = 0
+        self.rest_y = y
         self.bouncing = False
-        self.bounce_speed = 0
-        self.draw()
+        self.bounce_start = 0  # Frame it was hit on
     
-    def draw(self):
-        if self.is_active:
+    @staticmethod
+    def draw_frame(image, frame):
+        if frame == "active":
             # Yellow block with question mark
-            self.image.fill(QUESTION_YELLOW)
+            image.fill(QUESTION_YELLOW)
             
             # Border
-            pygame.draw.rect(self.image, (255, 215, 100), (0, 0, 32, 32), 3)
-            pygame.draw.rect(self.image, (200, 140, 0), (3, 3, 26, 26), 2)
+            pygame.draw.rect(image, (255, 215, 100), (0, 0, 32, 32), 3)
+            pygame.draw.rect(image, (200, 140, 0), (3, 3, 26, 26), 2)
             
             # Question mark
-            font = pygame.font.Font(None, 28)
-            text = font.render("?", True, WHITE)
+            text = BLOCK_TEXT.render("?")
             text_rect = text.get_rect(center=(16, 16))
-            self.image.blit(text, text_rect)
+            image.blit(text, text_rect)
             
             # Corner decorations
             for x, y in [(6, 6), (26, 6), (6, 26), (26, 26)]:
-                pygame.draw.circle(self.image, WHITE, (x, y), 2)
+                pygame.draw.circle(image, WHITE, (x, y), 2)
         else:
             # Used block (brown)
-            self.image.fill(BRICK_COLOR)
-            pygame.draw.rect(self.image, (150, 80, 40), (0, 0, 32, 32), 2)
+            image.fill(BRICK_COLOR)
+            pygame.draw.rect(image, (150, 80, 40), (0, 0, 32, 32), 2)
+    
+    def draw(self):
+        self.image = ATLAS.get(QuestionBlock, "active" if self.is_active else "used")
     
     def hit(self):
         """Called when Mario hits the block from below"""
         if self.is_active:
             self.is_active = False
             self.bouncing = True
-            self.bounce_speed = -8
             self.draw()
+            self.events.publish(BlockHit(self, self.item_type))
             return self.item_type
         return None
     
-    def update(self):
-        if self.bouncing:
-            self.bounce_offset += self.bounce_speed
-            self.rect.y += self.bounce_speed
-            self.bounce_speed += 1
-            
-            if self.bounce_offset >= 0:
-                self.rect.y -= self.bounce_offset
-                self.bounce_offset = 0
-                self.bouncing = False
-                self.bounce_speed = 0
+    def update(self, clock):
+        """Put the block where its bounce has it at frame clock"""
+        # Knocked up at 8 pixels a frame, slowing by one each frame until it lands
+        frames = clock - self.bounce_start + 1
+        offset = frames * (frames - 1) // 2 - 8 * frames
+        if offset >= 0:
+            offset = 0
+            self.bouncing = False
+        self.rect.y = self.rest_y + offset
 
 class Brick(pygame.sprite.Sprite):
     """Breakable brick block"""
-    def __init__(self, x, y, breakable=True):
+    frame_size = (32, 32)
+    atlas_frames = ("brick",)
+    
+    def __init__(self, x, y, events, breakable=True):
         super().__init__()
         self.width = 32
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height))
+        self.image = ATLAS.get(Brick, "brick")
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
         self.breakable = breakable
         self.broken = False
-        self.draw()
+        self.events = events  # EventBus told when the brick breaks
     
-    def draw(self):
+    @staticmethod
+    def draw_frame(image, frame):
         # Orange brick
-        self.image.fill(BRICK_COLOR)
+        image.fill(BRICK_COLOR)
         
         # Brick pattern
         for row in range(2):
             for col in range(2):
                 offset = row * 8
-                pygame.draw.rect(self.image, (160, 90, 45), 
+                pygame.draw.rect(image, (160, 90, 45), 
                                (col * 16 + offset, row * 16, 16, 16), 2)
     
     def hit(self):
         """Called when hit from below"""
-        if self.breakable:
+        if self.breakable and not self.broken:
             self.broken = True
+            self.events.publish(BrickBroken(self))
             return "break"
         return None
 
@@ -486,13 +2140,16 @@ class Pipe(pygame.sprite.Sprite):
         # Highlight
         pygame.draw.rect(self.image, (50, 220, 50), (36, 20, 4, self.height - 20))
 
-class Goomba(pygame.sprite.Sprite):
+class Goomba(Body, pygame.sprite.Sprite):
     """Goomba enemy"""
+    frame_size = (32, 32)
+    atlas_frames = ("walk", "squashed")  # The feet don't move, so walking is one frame
+    
     def __init__(self, x, y):
         super().__init__()
         self.width = 32
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.image = ATLAS.get(Goomba, "walk")
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
@@ -500,67 +2157,59 @@ class Goomba(pygame.sprite.Sprite):
         self.velocity_y = 0
         self.is_alive = True
         self.squashed = False
-        self.animation_frame = 0
-        self.animation_counter = 0
-        self.draw()
+        self.removal = None  # Timer that despawns it once squashed
     
-    def draw(self):
-        self.image.fill((0, 0, 0, 0))
+    @staticmethod
+    def draw_frame(image, frame):
+        image.fill((0, 0, 0, 0))
         
-        if self.squashed:
+        if frame == "squashed":
             # Flat squashed goomba
-            pygame.draw.ellipse(self.image, (139, 90, 43), (4, 20, 24, 8))
+            pygame.draw.ellipse(image, (139, 90, 43), (4, 20, 24, 8))
             return
         
         # Body
-        pygame.draw.ellipse(self.image, (139, 90, 43), (4, 8, 24, 22))
+        pygame.draw.ellipse(image, (139, 90, 43), (4, 8, 24, 22))
         
-        # Feet (animated)
-        foot_offset = 2 if self.animation_frame % 2 == 0 else -2
-        pygame.draw.ellipse(self.image, (101, 67, 33), (2, 26, 12, 6))
-        pygame.draw.ellipse(self.image, (101, 67, 33), (18, 26, 12, 6))
+        # Feet
+        pygame.draw.ellipse(image, (101, 67, 33), (2, 26, 12, 6))
+        pygame.draw.ellipse(image, (101, 67, 33), (18, 26, 12, 6))
         
         # Angry eyebrows
-        pygame.draw.line(self.image, BLACK, (8, 12), (11, 14), 3)
-        pygame.draw.line(self.image, BLACK, (24, 12), (21, 14), 3)
+        pygame.draw.line(image, BLACK, (8, 12), (11, 14), 3)
+        pygame.draw.line(image, BLACK, (24, 12), (21, 14), 3)
         
         # Eyes
-        pygame.draw.circle(self.image, WHITE, (10, 16), 4)
-        pygame.draw.circle(self.image, WHITE, (22, 16), 4)
-        pygame.draw.circle(self.image, BLACK, (10, 17), 2)
-        pygame.draw.circle(self.image, BLACK, (22, 17), 2)
+        pygame.draw.circle(image, WHITE, (10, 16), 4)
+        pygame.draw.circle(image, WHITE, (22, 16), 4)
+        pygame.draw.circle(image, BLACK, (10, 17), 2)
+        pygame.draw.circle(image, BLACK, (22, 17), 2)
         
         # Fangs
         points1 = [(14, 22), (16, 25), (18, 22)]
-        pygame.draw.polygon(self.image, WHITE, points1)
+        pygame.draw.polygon(image, WHITE, points1)
     
-    def update(self, platforms):
-        if not self.is_alive:
-            return
-        
-        # Animation
-        self.animation_counter += 1
-        if self.animation_counter >= 15:
-            self.animation_frame += 1
-            self.animation_counter = 0
-            if not self.squashed:
-                self.draw()
-        
-        if self.squashed:
+    def draw(self):
+        self.image = ATLAS.get(Goomba, "squashed" if self.squashed else "walk")
+    
+    def update(self, grid, dt=1.0):
+        # Squashed goombas linger until their removal timer despawns them
+        if not self.is_alive or self.engine is not None:
             return
         
         # Apply gravity
-        self.velocity_y += GRAVITY
+        self.velocity_y += GRAVITY * dt
         
         # Move
-        self.rect.x += self.velocity_x
-        self.rect.y += self.velocity_y
+        old_rect = self.rect.copy()
+        self.move_x(self.velocity_x * dt)
+        self.move_y(self.velocity_y * dt)
         
         # Check platform collisions
         on_platform = False
-        for platform in platforms:
+        for platform in grid.query(self.rect.union(old_rect), TERRAIN):
             if self.rect.colliderect(platform.rect):
-                if self.velocity_y > 0:
+                if self.velocity_y > 0 and old_rect.bottom <= platform.rect.top:
                     self.rect.bottom = platform.rect.top
                     self.velocity_y = 0
                     on_platform = True
@@ -576,52 +2225,65 @@ class Goomba(pygame.sprite.Sprite):
         """Called when Mario stomps on the goomba"""
         self.squashed = True
         self.is_alive = False
+        if self.engine is not None:
+            self.engine.freeze(self)
         self.draw()
 
-class Mushroom(pygame.sprite.Sprite):
+class Mushroom(Body, pygame.sprite.Sprite):
     """Super Mushroom power-up"""
+    frame_size = (32, 32)
+    atlas_frames = ("mushroom",)
+    
     def __init__(self, x, y):
         super().__init__()
         self.width = 32
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.image = ATLAS.get(type(self), "mushroom")
         self.rect = self.image.get_rect()
+        self.reset(x, y)
+    
+    def reset(self, x, y):
+        """Start over popping out of the block at x, y; pooled ones are reused this way"""
         self.rect.x = x
         self.rect.y = y - 32  # Spawn above block
         self.velocity_x = 2
         self.velocity_y = -4  # Pop up
-        self.draw()
     
-    def draw(self):
-        self.image.fill((0, 0, 0, 0))
+    @staticmethod
+    def draw_frame(image, frame):
+        image.fill((0, 0, 0, 0))
         
         # Stem
-        pygame.draw.rect(self.image, (250, 240, 230), (12, 18, 8, 12))
+        pygame.draw.rect(image, (250, 240, 230), (12, 18, 8, 12))
         
         # Cap
-        pygame.draw.ellipse(self.image, (220, 20, 60), (4, 6, 24, 18))
+        pygame.draw.ellipse(image, (220, 20, 60), (4, 6, 24, 18))
         
         # White spots
-        pygame.draw.circle(self.image, WHITE, (10, 12), 4)
-        pygame.draw.circle(self.image, WHITE, (22, 12), 4)
-        pygame.draw.circle(self.image, WHITE, (16, 18), 3)
+        pygame.draw.circle(image, WHITE, (10, 12), 4)
+        pygame.draw.circle(image, WHITE, (22, 12), 4)
+        pygame.draw.circle(image, WHITE, (16, 18), 3)
         
         # Eyes
-        pygame.draw.circle(self.image, BLACK, (13, 22), 2)
-        pygame.draw.circle(self.image, BLACK, (19, 22), 2)
+        pygame.draw.circle(image, BLACK, (13, 22), 2)
+        pygame.draw.circle(image, BLACK, (19, 22), 2)
     
-    def update(self, platforms):
+    def update(self, grid, dt=1.0):
+        if self.engine is not None:
+            return  # The body engine moves it
+        
         # Apply gravity
-        self.velocity_y += GRAVITY
+        self.velocity_y += GRAVITY * dt
         
         # Move
-        self.rect.x += self.velocity_x
-        self.rect.y += self.velocity_y
+        old_rect = self.rect.copy()
+        self.move_x(self.velocity_x * dt)
+        self.move_y(self.velocity_y * dt)
         
         # Platform collision
-        for platform in platforms:
+        for platform in grid.query(self.rect.union(old_rect), TERRAIN):
             if self.rect.colliderect(platform.rect):
-                if self.velocity_y > 0:
+                if self.velocity_y > 0 and old_rect.bottom <= platform.rect.top:
                     self.rect.bottom = platform.rect.top
                     self.velocity_y = 0
                 if self.rect.right > platform.rect.left and self.velocity_x > 0:
@@ -629,33 +2291,37 @@ class Mushroom(pygame.sprite.Sprite):
                 if self.rect.left < platform.rect.right and self.velocity_x < 0:
                     self.velocity_x *= -1
 
-class FireFlower(pygame.sprite.Sprite):
+class FireFlower(Body, pygame.sprite.Sprite):
     """Fire Flower power-up"""
+    frame_size = (32, 32)
+    atlas_frames = ("flower",)  # The petals don't turn, so the animation is one frame
+    
     def __init__(self, x, y):
         super().__init__()
         self.width = 32
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.image = ATLAS.get(FireFlower, "flower")
         self.rect = self.image.get_rect()
+        self.reset(x, y)
+    
+    def reset(self, x, y):
+        """Start over popping out of the block at x, y; pooled ones are reused this way"""
         self.rect.x = x
         self.rect.y = y - 32  # Spawn above block
         self.velocity_y = -4  # Pop up
-        self.animation_frame = 0
-        self.animation_counter = 0
-        self.draw()
     
-    def draw(self):
-        self.image.fill((0, 0, 0, 0))
+    @staticmethod
+    def draw_frame(image, frame):
+        image.fill((0, 0, 0, 0))
         
         # Stem (green)
-        pygame.draw.rect(self.image, (0, 168, 0), (12, 20, 8, 10))
+        pygame.draw.rect(image, (0, 168, 0), (12, 20, 8, 10))
         
         # Flower petals (alternating red/orange/yellow)
         colors = [(255, 0, 0), (255, 165, 0), (255, 255, 0), (255, 100, 0)]
-        angle_offset = (self.animation_frame * 10) % 360
         
         # Center
-        pygame.draw.circle(self.image, (255, 255, 0), (16, 14), 6)
+        pygame.draw.circle(image, (255, 255, 0), (16, 14), 6)
         
         # Petals
         petal_positions = [
@@ -667,69 +2333,60 @@ class FireFlower(pygame.sprite.Sprite):
         
         for i, (px, py) in enumerate(petal_positions):
             color = colors[i % len(colors)]
-            pygame.draw.circle(self.image, color, (px, py), 5)
+            pygame.draw.circle(image, color, (px, py), 5)
         
         # Eyes on center
-        pygame.draw.circle(self.image, BLACK, (14, 13), 1)
-        pygame.draw.circle(self.image, BLACK, (18, 13), 1)
+        pygame.draw.circle(image, BLACK, (14, 13), 1)
+        pygame.draw.circle(image, BLACK, (18, 13), 1)
     
-    def update(self, platforms):
-        # Animation
-        self.animation_counter += 1
-        if self.animation_counter >= 10:
-            self.animation_frame += 1
-            self.animation_counter = 0
-            self.draw()
+    def update(self, grid, dt=1.0):
+        if self.engine is not None:
+            return  # The body engine moves it
         
         # Apply gravity
-        self.velocity_y += GRAVITY
+        self.velocity_y += GRAVITY * dt
         
         # Move
-        self.rect.y += self.velocity_y
+        old_rect = self.rect.copy()
+        self.move_y(self.velocity_y * dt)
         
         # Platform collision
-        for platform in platforms:
+        for platform in grid.query(self.rect.union(old_rect), TERRAIN):
             if self.rect.colliderect(platform.rect):
-                if self.velocity_y > 0:
+                if self.velocity_y > 0 and old_rect.bottom <= platform.rect.top:
                     self.rect.bottom = platform.rect.top
                     self.velocity_y = 0
 
-class Star(pygame.sprite.Sprite):
+class Star(Body, pygame.sprite.Sprite):
     """Invincibility Star power-up"""
+    bounce = -8
+    colors = [(255, 0, 0), (255, 165, 0), (255, 255, 0), (0, 255, 0), 
+              (0, 0, 255), (138, 43, 226)]
+    frame_size = (32, 32)
+    atlas_frames = range(len(colors))
+    
     def __init__(self, x, y):
         super().__init__()
         self.width = 32
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        self.rect = self.image.get_rect()
+        self.rect = pygame.Rect(0, 0, self.width, self.height)
+        self.reset(x, y)
+    
+    def reset(self, x, y):
+        """Start over popping out of the block at x, y; pooled ones are reused this way"""
         self.rect.x = x
         self.rect.y = y - 32  # Spawn above block
         self.velocity_x = 3
         self.velocity_y = -8  # Pop up and bounce
-        self.animation_frame = 0
-        self.animation_counter = 0
-        self.draw()
+        self.phase = 0  # Frame the color cycle starts on
+        self.image = ATLAS.get(Star, 0)
     
-    def draw(self):
-        self.image.fill((0, 0, 0, 0))
+    @staticmethod
+    def draw_frame(image, frame):
+        image.fill((0, 0, 0, 0))
         
         # Rotating rainbow star
-        colors = [(255, 0, 0), (255, 165, 0), (255, 255, 0), (0, 255, 0), 
-                  (0, 0, 255), (138, 43, 226)]
-        color = colors[self.animation_frame % len(colors)]
-        
-        # Draw star
-        center_x, center_y = 16, 16
-        points = []
-        for i in range(10):
-            angle = (i * 36 - 90) * 3.14159 / 180
-            if i % 2 == 0:
-                radius = 12
-            else:
-                radius = 5
-            x = center_x + radius * (angle and 1) * 10  # Simplified
-            y = center_y + radius * (angle and 1) * 10
-            points.append((x, y))
+        color = Star.colors[frame]
         
         # Simple star shape
         star_points = [
@@ -745,31 +2402,33 @@ class Star(pygame.sprite.Sprite):
             (13, 12),  # Top left inner
         ]
         
-        pygame.draw.polygon(self.image, color, star_points)
-        pygame.draw.polygon(self.image, WHITE, star_points, 2)
+        pygame.draw.polygon(image, color, star_points)
+        pygame.draw.polygon(image, WHITE, star_points, 2)
         
         # Sparkles
-        pygame.draw.circle(self.image, WHITE, (16, 16), 3)
+        pygame.draw.circle(image, WHITE, (16, 16), 3)
     
-    def update(self, platforms):
-        # Animation
-        self.animation_counter += 1
-        if self.animation_counter >= 5:
-            self.animation_frame += 1
-            self.animation_counter = 0
-            self.draw()
+    def animate(self, clock):
+        """(image, y offset) to draw at frame clock"""
+        color = (clock - self.phase) // STAR_COLOR_FRAMES % len(Star.colors)
+        return ATLAS.get(Star, color), 0
+    
+    def update(self, grid, dt=1.0):
+        if self.engine is not None:
+            return  # The body engine moves it
         
         # Apply gravity
-        self.velocity_y += GRAVITY
+        self.velocity_y += GRAVITY * dt
         
         # Move
-        self.rect.x += self.velocity_x
-        self.rect.y += self.velocity_y
+        old_rect = self.rect.copy()
+        self.move_x(self.velocity_x * dt)
+        self.move_y(self.velocity_y * dt)
         
         # Platform collision - bounce
-        for platform in platforms:
+        for platform in grid.query(self.rect.union(old_rect), TERRAIN):
             if self.rect.colliderect(platform.rect):
-                if self.velocity_y > 0:
+                if self.velocity_y > 0 and old_rect.bottom <= platform.rect.top:
                     self.rect.bottom = platform.rect.top
                     self.velocity_y = -8  # Bounce
                 if self.rect.right > platform.rect.left and self.velocity_x > 0:
@@ -777,50 +2436,61 @@ class Star(pygame.sprite.Sprite):
                 if self.rect.left < platform.rect.right and self.velocity_x < 0:
                     self.velocity_x *= -1
 
-class OneUpMushroom(pygame.sprite.Sprite):
+class OneUpMushroom(Body, pygame.sprite.Sprite):
     """1-Up Mushroom (extra life)"""
+    frame_size = (32, 32)
+    atlas_frames = ("mushroom",)
+    
     def __init__(self, x, y):
         super().__init__()
         self.width = 32
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.image = ATLAS.get(type(self), "mushroom")
         self.rect = self.image.get_rect()
+        self.reset(x, y)
+    
+    def reset(self, x, y):
+        """Start over popping out of the block at x, y; pooled ones are reused this way"""
         self.rect.x = x
         self.rect.y = y - 32  # Spawn above block
         self.velocity_x = 2
         self.velocity_y = -4  # Pop up
-        self.draw()
     
-    def draw(self):
-        self.image.fill((0, 0, 0, 0))
+    @staticmethod
+    def draw_frame(image, frame):
+        image.fill((0, 0, 0, 0))
         
         # Stem
-        pygame.draw.rect(self.image, (250, 240, 230), (12, 18, 8, 12))
+        pygame.draw.rect(image, (250, 240, 230), (12, 18, 8, 12))
         
         # Cap (green instead of red)
-        pygame.draw.ellipse(self.image, (0, 200, 0), (4, 6, 24, 18))
+        pygame.draw.ellipse(image, (0, 200, 0), (4, 6, 24, 18))
         
         # White spots
-        pygame.draw.circle(self.image, WHITE, (10, 12), 4)
-        pygame.draw.circle(self.image, WHITE, (22, 12), 4)
-        pygame.draw.circle(self.image, WHITE, (16, 18), 3)
+        pygame.draw.circle(image, WHITE, (10, 12), 4)
+        pygame.draw.circle(image, WHITE, (22, 12), 4)
+        pygame.draw.circle(image, WHITE, (16, 18), 3)
         
         # Eyes
-        pygame.draw.circle(self.image, BLACK, (13, 22), 2)
-        pygame.draw.circle(self.image, BLACK, (19, 22), 2)
+        pygame.draw.circle(image, BLACK, (13, 22), 2)
+        pygame.draw.circle(image, BLACK, (19, 22), 2)
     
-    def update(self, platforms):
+    def update(self, grid, dt=1.0):
+        if self.engine is not None:
+            return  # The body engine moves it
+        
         # Apply gravity
-        self.velocity_y += GRAVITY
+        self.velocity_y += GRAVITY * dt
         
         # Move
-        self.rect.x += self.velocity_x
-        self.rect.y += self.velocity_y
+        old_rect = self.rect.copy()
+        self.move_x(self.velocity_x * dt)
+        self.move_y(self.velocity_y * dt)
         
         # Platform collision
-        for platform in platforms:
+        for platform in grid.query(self.rect.union(old_rect), TERRAIN):
             if self.rect.colliderect(platform.rect):
-                if self.velocity_y > 0:
+                if self.velocity_y > 0 and old_rect.bottom <= platform.rect.top:
                     self.rect.bottom = platform.rect.top
                     self.velocity_y = 0
                 if self.rect.right > platform.rect.left and self.velocity_x > 0:
@@ -828,428 +2498,1084 @@ class OneUpMushroom(pygame.sprite.Sprite):
                 if self.rect.left < platform.rect.right and self.velocity_x < 0:
                     self.velocity_x *= -1
 
-class Fireball(pygame.sprite.Sprite):
+class Fireball(Body, pygame.sprite.Sprite):
     """Fireball that Mario shoots"""
+    gravity = GRAVITY * 0.5
+    bounce = -4
+    turns_at_walls = False
+    colors = [(255, 100, 0), (255, 200, 0), (255, 255, 100)]
+    frame_size = (16, 16)
+    atlas_frames = range(len(colors))
+    
     def __init__(self, x, y, direction):
         super().__init__()
         self.width = 16
         self.height = 16
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        self.rect = self.image.get_rect()
+        self.rect = pygame.Rect(0, 0, self.width, self.height)
+        self.expiry = None  # Timer that burns the current shot out
+        self.reset(x, y, direction)
+    
+    def reset(self, x, y, direction):
+        """Start a fresh shot from x, y; pooled fireballs are reused this way"""
         self.rect.x = x
         self.rect.y = y
         self.velocity_x = 8 * direction
         self.velocity_y = -3
-        self.lifetime = 180  # 3 seconds
-        self.animation_frame = 0
-        self.draw()
+        self.phase = 0  # Frame the color cycle starts on
+        self.image = ATLAS.get(Fireball, 0)
     
-    def draw(self):
-        self.image.fill((0, 0, 0, 0))
+    @staticmethod
+    def draw_frame(image, frame):
+        image.fill((0, 0, 0, 0))
         
         # Rotating fireball
-        colors = [(255, 100, 0), (255, 200, 0), (255, 255, 100)]
-        color = colors[self.animation_frame % 3]
+        color = Fireball.colors[frame]
         
-        pygame.draw.circle(self.image, color, (8, 8), 7)
-        pygame.draw.circle(self.image, (255, 255, 200), (8, 8), 4)
-        pygame.draw.circle(self.image, WHITE, (6, 6), 2)
+        pygame.draw.circle(image, color, (8, 8), 7)
+        pygame.draw.circle(image, (255, 255, 200), (8, 8), 4)
+        pygame.draw.circle(image, WHITE, (6, 6), 2)
     
-    def update(self, platforms):
-        self.animation_frame += 1
-        self.draw()
-        
-        # Apply gravity
-        self.velocity_y += GRAVITY * 0.5
-        
-        # Move
-        self.rect.x += self.velocity_x
-        self.rect.y += self.velocity_y
-        
-        # Bounce off ground
-        for platform in platforms:
-            if self.rect.colliderect(platform.rect):
-                if self.velocity_y > 0:
-                    self.rect.bottom = platform.rect.top
-                    self.velocity_y = -4  # Bounce
-        
-        # Lifetime
-        self.lifetime -= 1
-        if self.lifetime <= 0:
-            self.kill()
+    def animate(self, clock):
+        """(image, y offset) to draw at frame clock"""
+        return ATLAS.get(Fireball, (clock - self.phase) % len(Fireball.colors)), 0
+    
+    def update(self, grid, dt=1.0):
+        if self.engine is None:
+            # Apply gravity
+            self.velocity_y += GRAVITY * 0.5 * dt
+            
+            # Move
+            old_rect = self.rect.copy()
+            self.move_x(self.velocity_x * dt)
+            self.move_y(self.velocity_y * dt)
+            
+            # Bounce off ground
+            for platform in grid.query(self.rect.union(old_rect), TERRAIN):
+                if self.rect.colliderect(platform.rect):
+                    if self.velocity_y > 0 and old_rect.bottom <= platform.rect.top:
+                        self.rect.bottom = platform.rect.top
+                        self.velocity_y = -4  # Bounce
+
+# Most fireballs in flight at once: one per cooldown over a fireball's lifetime
+FIREBALL_POOL_SIZE = FIREBALL_LIFETIME // FIREBALL_COOLDOWN
+
+class SpritePool:
+    """Spare sprites of one class, reset and handed out again instead of built from scratch
+
+    A sprite is spare once it is in no group and the activation window has
+    forgotten it: collected, burnt out, fallen out of the world or dropped by
+    a restored checkpoint. The class needs a reset() taking its constructor's
+    arguments.
+    """
+    def __init__(self, cls, activation):
+        self.cls = cls
+        self.activation = activation
+        self.spares = []
+        self.issued = []  # Handed out and maybe still in play
+        self.created = 0
+        self.reused = 0
+    
+    def is_spare(self, sprite):
+        return not sprite.alive() and sprite not in self.activation
+    
+    def reclaim(self):
+        """Move issued sprites that have been thrown away to the spares"""
+        issued = []
+        for sprite in self.issued:
+            (self.spares if self.is_spare(sprite) else issued).append(sprite)
+        self.issued = issued
+    
+    def acquire(self, *args):
+        """A sprite as cls(*args) would build it"""
+        if not self.spares:
+            self.reclaim()
+        while self.spares:
+            sprite = self.spares.pop()
+            if self.is_spare(sprite):
+                sprite.reset(*args)
+                self.reused += 1
+                break
+            # Back in play since it was reclaimed, e.g. by a restored checkpoint
+            self.issued.append(sprite)
+        else:
+            sprite = self.cls(*args)
+            self.created += 1
+        self.issued.append(sprite)
+        return sprite
+    
+    def prefill(self, count, *args):
+        """Build count spares up front, so the first ones used cost nothing mid-level"""
+        for _ in range(count):
+            self.spares.append(self.cls(*args))
+        self.created += count
+    
+    def stats(self):
+        """Sprites built, reuses, and how many are in play or spare right now"""
+        in_play = sum(not self.is_spare(sprite) for sprite in self.issued)
+        return {"created": self.created, "reused": self.reused, "in_play": in_play,
+                "spare": self.created - in_play}
 
 class Coin(pygame.sprite.Sprite):
     """Collectible coin"""
+    frame_size = (24, 32)
+    atlas_frames = ("coin",)
+    
     def __init__(self, x, y, floating=True):
         super().__init__()
         self.width = 24
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.image = ATLAS.get(Coin, "coin")
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
         self.floating = floating
-        self.float_offset = 0
-        self.float_direction = 1
-        self.animation_frame = 0
-        self.draw()
+        self.phase = 0  # Frame the bob starts on; level coins all bob together
     
-    def draw(self):
-        self.image.fill((0, 0, 0, 0))
+    @staticmethod
+    def draw_frame(image, frame):
+        image.fill((0, 0, 0, 0))
         
         # Coin
-        pygame.draw.ellipse(self.image, COIN_GOLD, (2, 8, 20, 20))
-        pygame.draw.ellipse(self.image, (218, 165, 32), (5, 11, 14, 14))
+        pygame.draw.ellipse(image, COIN_GOLD, (2, 8, 20, 20))
+        pygame.draw.ellipse(image, (218, 165, 32), (5, 11, 14, 14))
         
         # Shine
-        pygame.draw.circle(self.image, (255, 255, 200), (10, 14), 4)
+        pygame.draw.circle(image, (255, 255, 200), (10, 14), 4)
     
-    def update(self):
-        if self.floating:
-            self.animation_frame += 1
-            if self.animation_frame % 3 == 0:
-                self.rect.y += self.float_direction
-                self.float_offset += self.float_direction
-                if abs(self.float_offset) > 4:
-                    self.float_direction *= -1
+    def animate(self, clock):
+        """(image, y offset) to draw at frame clock; the coin itself never moves"""
+        if not self.floating:
+            return self.image, 0
+        # Up to COIN_BOB_HEIGHT, down to -COIN_BOB_HEIGHT and back, a pixel at a time
+        step = (clock - self.phase) // COIN_BOB_FRAMES + COIN_BOB_HEIGHT
+        return self.image, COIN_BOB_HEIGHT - abs(step % (4 * COIN_BOB_HEIGHT) - 2 * COIN_BOB_HEIGHT)
 
 class Flag(pygame.sprite.Sprite):
     """Level end flag"""
+    frame_size = (48, 320)
+    atlas_frames = ("flag",)
+    
     def __init__(self, x, y):
         super().__init__()
         self.width = 48
         self.height = 320
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.image = ATLAS.get(Flag, "flag")
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
-        self.draw()
     
-    def draw(self):
-        self.image.fill((0, 0, 0, 0))
+    @staticmethod
+    def draw_frame(image, frame):
+        image.fill((0, 0, 0, 0))
         
         # Pole
-        pygame.draw.rect(self.image, WHITE, (22, 0, 4, 320))
+        pygame.draw.rect(image, WHITE, (22, 0, 4, 320))
         
         # Flag
         flag_color = (0, 200, 0)
         points = [(26, 20), (46, 30), (26, 40)]
-        pygame.draw.polygon(self.image, flag_color, points)
-        pygame.draw.polygon(self.image, BLACK, points, 2)
+        pygame.draw.polygon(image, flag_color, points)
+        pygame.draw.polygon(image, BLACK, points, 2)
         
         # Pole top
-        pygame.draw.circle(self.image, WHITE, (24, 10), 6)
+        pygame.draw.circle(image, WHITE, (24, 10), 6)
+
+# Sprite classes whose frames are baked into the atlas
+ATLAS_CLASSES = (QuestionBlock, Brick, Goomba, Mushroom, FireFlower, Star, OneUpMushroom, Fireball,
+                 Coin, Flag)
+
+# Level files: an editable text source, compiled to a compact binary on first load
+LEVEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "levels")
+LEVEL_SOURCE = ".level"
+LEVEL_COMPILED = ".levelc"
+DEFAULT_LEVEL = "1-1"
+LEVEL_MAGIC = b"MLVL"
+LEVEL_VERSION = 2
+LEVEL_HEADER = struct.Struct("<4sHxxiiiiiiii")  # magic, version, width, start, flag,
+                                                # record count, chunk width, chunk count
+LEVEL_CHUNK = struct.Struct("<II")              # first record, record count
+LEVEL_RECORD = struct.Struct("<BBxxiiii")       # kind, item, x, y, w, h
+LEVEL_CHUNK_WIDTH = 1024  # Compiled records are grouped into chunks this wide by left edge
+STREAM_MARGIN = 1024          # Streamed chunks are built this far beyond the edge of the screen
+STREAM_RELEASE_MARGIN = 2048  # and released once they are this far away
+
+# Record kinds, in the order build_level adds them, and their source arguments
+LEVEL_KINDS = ("ground", "block", "brick", "pipe", "coin", "goomba", "mushroom")
+LEVEL_FIELDS = {
+    "ground": ("x", "y", "w", "h"),
+    "block": ("x", "y", "item"),
+    "brick": ("x", "y"),
+    "pipe": ("x", "y", "h"),
+    "coin": ("x", "y"),
+    "goomba": ("x", "y"),
+    "mushroom": ("x", "y"),
+}
+BLOCK_ITEMS = ("coin", "mushroom", "fire_flower", "star", "1up")
+
+class Level:
+    """Everything build_level needs: size, start and flag, and (kind, item, x, y, w, h) records"""
+    def __init__(self, name, width, start, flag=None, records=()):
+        self.name = name
+        self.width = width
+        self.start = start
+        self.flag = flag or (width - 200, 230)
+        self.records = list(records)
+    
+    @classmethod
+    def parse(cls, text, name="level"):
+        """Read the text source format"""
+        width, start, flag = 6400, (100, 400), None
+        records = []
+        for number, line in enumerate(text.splitlines(), 1):
+            words = line.split("#", 1)[0].split()
+            if not words:
+                continue
+            keyword, args = words[0], words[1:]
+            try:
+                if keyword == "width":
+                    (width,) = map(int, args)
+                elif keyword == "start":
+                    start = tuple(map(int, args))
+                    if len(start) != 2:
+                        raise ValueError("expected X Y")
+                elif keyword == "flag":
+                    flag = tuple(map(int, args))
+                    if len(flag) != 2:
+                        raise ValueError("expected X Y")
+                elif keyword in LEVEL_FIELDS:
+                    names = LEVEL_FIELDS[keyword]
+                    if len(args) != len(names):
+                        raise ValueError("expected " + " ".join(field.upper() for field in names))
+                    fields = dict(zip(names, args))
+                    item = 0
+                    if keyword == "block":
+                        if fields["item"] not in BLOCK_ITEMS:
+                            raise ValueError(f"unknown item {fields['item']!r}")
+                        item = BLOCK_ITEMS.index(fields["item"])
+                    x, y = int(fields["x"]), int(fields["y"])
+                    w, h = int(fields.get("w", 0)), int(fields.get("h", 0))
+                    records.append((LEVEL_KINDS.index(keyword), item, x, y, w, h))
+                else:
+                    raise ValueError("unknown record")
+            except ValueError as error:
+                raise ValueError(f"{name}:{number}: bad {keyword!r} line: {error}") from None
+        return cls(name, width, start, flag, records)
+    
+    def chunked(self, chunk_width=LEVEL_CHUNK_WIDTH):
+        """Records grouped by the chunk their left edge is in, ground split at chunk edges"""
+        chunks = {}
+        for kind, item, x, y, w, h in self.records:
+            if kind == 0:
+                # Split on the ground's own 16px tiling so the pieces join up seamlessly
+                while x // chunk_width != (x + w - 1) // chunk_width:
+                    edge = (x // chunk_width + 1) * chunk_width
+                    piece = -(-(edge - x) // 16) * 16
+                    if piece >= w:
+                        break
+                    chunks.setdefault(max(0, x // chunk_width), []).append((kind, item, x, y, piece, h))
+                    x, w = x + piece, w - piece
+            chunks.setdefault(max(0, x // chunk_width), []).append((kind, item, x, y, w, h))
+        
+        count = max(chunks, default=-1) + 1
+        # Within a chunk, keep the order build_level has always added kinds in
+        return [sorted(chunks.get(index, ()), key=lambda record: record[0])
+                for index in range(count)]
+    
+    def compile(self, chunk_width=LEVEL_CHUNK_WIDTH):
+        """Pack the level into its binary form: header, chunk table, then records by chunk"""
+        chunks = self.chunked(chunk_width)
+        table = []
+        first = 0
+        for records in chunks:
+            table.append(LEVEL_CHUNK.pack(first, len(records)))
+            first += len(records)
+        header = LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, self.width, *self.start,
+                                   *self.flag, first, chunk_width, len(chunks))
+        return b"".join([header, *table, *(LEVEL_RECORD.pack(*record)
+                                           for records in chunks for record in records)])
+    
+    @classmethod
+    def unpack(cls, data, name="level"):
+        """Read the binary form"""
+        header = read_level_header(data, name)
+        start = LEVEL_HEADER.size + header["chunks"] * LEVEL_CHUNK.size
+        body = memoryview(data)[start:start + header["count"] * LEVEL_RECORD.size]
+        return cls(name, header["width"], header["start"], header["flag"],
+                   LEVEL_RECORD.iter_unpack(body))
+    
+    @classmethod
+    def load(cls, level=DEFAULT_LEVEL):
+        """Load a level by name or source path, compiling it if the binary is stale"""
+        source, compiled, name = level_paths(level)
+        if compiled_is_fresh(level):
+            try:
+                with open(compiled, "rb") as f:
+                    return cls.unpack(f.read(), name)
+            except (OSError, ValueError, struct.error):
+                pass  # Changed under us, so compile it again
+        return compile_level(source)
+
+def read_level_header(data, name="level"):
+    """Fields of a compiled level's header"""
+    magic, version, width, start_x, start_y, flag_x, flag_y, count, chunk_width, chunks = \
+        LEVEL_HEADER.unpack_from(data)
+    if magic != LEVEL_MAGIC or version != LEVEL_VERSION:
+        raise ValueError(f"{name}: not a version {LEVEL_VERSION} compiled level")
+    return {
+        "width": width,
+        "start": (start_x, start_y),
+        "flag": (flag_x, flag_y),
+        "count": count,
+        "chunk_width": chunk_width,
+        "chunks": chunks,
+    }
+
+def level_paths(level):
+    """Source path, compiled path and name for a level name or source path"""
+    source = level if level.endswith(LEVEL_SOURCE) else os.path.join(LEVEL_DIR, level + LEVEL_SOURCE)
+    name = os.path.basename(source)[:-len(LEVEL_SOURCE)]
+    return source, source[:-len(LEVEL_SOURCE)] + LEVEL_COMPILED, name
+
+def compiled_is_fresh(level):
+    """Whether a level's binary is newer than its source and in the current format
+
+    Only the header is read, so this costs the same however big the level is.
+    """
+    source, compiled, name = level_paths(level)
+    try:
+        if os.path.getmtime(compiled) < os.path.getmtime(source):
+            return False
+        with open(compiled, "rb") as f:
+            read_level_header(f.read(LEVEL_HEADER.size), name)
+    except (OSError, ValueError, struct.error):
+        return False  # Missing, unreadable or an older version
+    return True
+
+def write_compiled(source):
+    """Compile a level source file to its binary next to it; returns (binary, name)"""
+    source, compiled, name = level_paths(source)
+    with open(source) as f:
+        data = Level.parse(f.read(), name).compile()
+    try:
+        with open(compiled, "wb") as f:
+            f.write(data)
+    except OSError:
+        pass  # Read-only install; the source still loads, just not as fast
+    return data, name
+
+def compile_level(source):
+    """Compile a level source file to its binary next to it, and return the level"""
+    return Level.unpack(*write_compiled(source))
+
+def level_names(directory=LEVEL_DIR):
+    """Names of the level sources shipped in a directory"""
+    return sorted(name[:-len(LEVEL_SOURCE)] for name in os.listdir(directory)
+                  if name.endswith(LEVEL_SOURCE))
+
+class LevelStream:
+    """Compiled level memory-mapped from disk, instantiated a chunk at a time around the camera"""
+    def __init__(self, level=DEFAULT_LEVEL, margin=STREAM_MARGIN, release_margin=STREAM_RELEASE_MARGIN):
+        source, compiled, self.name = level_paths(level)
+        if not compiled_is_fresh(level):
+            write_compiled(source)
+        with open(compiled, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = read_level_header(self.data, self.name)
+        self.width = header["width"]
+        self.start = header["start"]
+        self.flag = header["flag"]
+        self.chunk_width = header["chunk_width"]
+        self.chunk_count = header["chunks"]
+        self.records_at = LEVEL_HEADER.size + self.chunk_count * LEVEL_CHUNK.size
+        self.records = ()  # Nothing is built up front
+        
+        self.margin = margin
+        self.release_margin = release_margin
+        self.resident = {}  # chunk index -> [(record number, sprite)]
+        self.spent = set()  # Records collected, broken or defeated, never rebuilt
+        self.used = set()   # Question blocks already emptied
+    
+    def chunk_records(self, index):
+        """(record number, record) for every record in a chunk, read straight from the map"""
+        first, count = LEVEL_CHUNK.unpack_from(self.data, LEVEL_HEADER.size + index * LEVEL_CHUNK.size)
+        start = self.records_at + first * LEVEL_RECORD.size
+        body = self.data[start:start + count * LEVEL_RECORD.size]
+        return enumerate(LEVEL_RECORD.iter_unpack(body), first)
+    
+    def update(self, game, left, right):
+        """Build chunks near the visible x range and release those far behind or ahead"""
+        for index in list(self.resident):
+            start = index * self.chunk_width
+            if (start + self.chunk_width < left - self.release_margin or
+                    start > right + self.release_margin):
+                self.release(game, index)
+        
+        first = max(0, (left - self.margin) // self.chunk_width)
+        last = min(self.chunk_count - 1, (right + self.margin) // self.chunk_width)
+        loaded = False
+        for index in range(first, last + 1):
+            if index not in self.resident:
+                self.load(game, index)
+                loaded = True
+        if loaded:
+            game.static_layer.bake_all()
+    
+    def load(self, game, index):
+        sprites = []
+        for number, record in self.chunk_records(index):
+            if number in self.spent:
+                continue
+            sprite = game.add_record(*record)
+            if number in self.used:
+                sprite.is_active = False
+                sprite.draw()
+            sprites.append((number, sprite))
+        self.resident[index] = sprites
+    
+    def release(self, game, index):
+        for number, sprite in self.resident.pop(index):
+            if game.record_spent(sprite):
+                self.spent.add(number)
+            elif isinstance(sprite, QuestionBlock) and not sprite.is_active:
+                self.used.add(number)
+            game.remove_record(sprite)
+    
+    def close(self):
+        self.data.close()
+
+# Sprite attributes a checkpoint leaves alone: surfaces, group bookkeeping, engine slots,
+# the timer wheel and the event bus; the timer handles themselves are saved
+CHECKPOINT_SKIP = frozenset(("_Sprite__g", "image", "rect", "engine", "slot", "timers", "events"))
+
+# Groups whose membership a checkpoint restores; pipes only change on streamed levels
+CHECKPOINT_GROUPS = ("all_sprites", "question_blocks", "bricks", "pipes", "enemies", "mushrooms",
+                     "fire_flowers", "stars", "oneup_mushrooms", "coin_sprites", "fireballs")
+
+class Checkpoint:
+    """Game state captured by Game.snapshot, for Game.restore to put back in place"""
+    def __init__(self, game):
+        self.values = (game.score, game.coins, game.lives, game.time_left, game.timers.now, game.level_clock)
+        self.mario = self.capture(game.mario)
+        if game.stream is not None:
+            # Resident chunks are kept as they are; the rest are rebuilt from the file
+            # with what was used up in them left out
+            self.resident = dict(game.stream.resident)
+            self.spent = set(game.stream.spent)
+            self.used = set(game.stream.used)
+        
+        self.groups = {name: list(getattr(game, name)) for name in CHECKPOINT_GROUPS}
+        self.dormant = list(game.activation.dormant)
+        self.active = dict(game.activation.active)
+        self.sprites = {}
+        for sprites in self.groups.values():
+            for sprite in sprites:
+                if sprite not in self.sprites:
+                    self.sprites[sprite] = self.capture(sprite)
+        for entry in self.dormant:
+            self.sprites[entry[2]] = self.capture(entry[2])
+    
+    @staticmethod
+    def capture(sprite):
+        """(attributes, rect) of a sprite"""
+        state = {key: value for key, value in vars(sprite).items() if key not in CHECKPOINT_SKIP}
+        if isinstance(sprite, Body):
+            if sprite.engine is not None:
+                # Attached bodies keep their velocity in the engine's arrays
+                state["_velocity_x"] = sprite.velocity_x
+                state["_velocity_y"] = sprite.velocity_y
+            # Fine positions are saved even while unset, so a restore drops any picked up since
+            state["_fine_x"], state["_fine_y"] = sprite.fine_x, sprite.fine_y
+        elif isinstance(sprite, SubPixel):
+            state["fine_x"], state["fine_y"] = sprite.fine_x, sprite.fine_y
+        return state, sprite.rect.copy()
+    
+    @staticmethod
+    def apply(sprite, saved):
+        state, rect = saved
+        vars(sprite).update(state)
+        sprite.rect.update(rect)
 
 class Game:
     """Main game class"""
-    def __init__(self):
+    def __init__(self, headless=False, render=True, input_source=None, vectorized=False,
+                 level=DEFAULT_LEVEL, stream=False, recorder=None, observation="vector",
+                 downsample=1, profiler=None, allocations=None, sim_rate=SIM_RATE):
+        self.headless = headless
+        self.sim_rate = sim_rate
+        self.dt = FPS / sim_rate  # Frames of physics each step covers
+        self.recorder = recorder  # InputLog that every frame's input is written to
+        self.profiler = profiler  # FrameProfiler timing each phase, or None for no overhead
+        self.allocations = allocations  # AllocationTracker snapshotting every frame, debug only
+        self.vectorized = vectorized
+        # A streamed level is read from its memory-mapped file a chunk at a time
+        if stream:
+            self.stream = level if isinstance(level, LevelStream) else LevelStream(level)
+            self.level = self.stream
+        else:
+            self.stream = None
+            self.level = level if isinstance(level, Level) else Level.load(level)
+        self.rendering = render or not headless
+        if headless:
+            # The dummy driver needs no display; it must be picked before the display starts
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            if pygame.display.get_init() and pygame.display.get_driver() != "dummy":
+                pygame.display.quit()
+            pygame.display.init()
+        elif not pygame.display.get_init():
+            pygame.display.init()
+        
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Super Mario Bros")
         self.clock = pygame.time.Clock()
         self.running = True
+        self.input = input_source or KeyboardInput()
         
         # Game state
         self.score = 0
         self.coins = 0
         self.lives = 3
         self.time_left = 400
-        self.level_width = 6400
+        self.level_width = self.level.width
         
         # Camera
         self.camera = Camera(self.level_width, SCREEN_HEIGHT)
         
         # Sprite groups
-        self.all_sprites = pygame.sprite.Group()
+        self.all_sprites = SpriteIndex()
         self.platforms = []
         self.question_blocks = pygame.sprite.Group()
         self.bricks = pygame.sprite.Group()
         self.pipes = pygame.sprite.Group()
-        self.enemies = pygame.sprite.Group()
-        self.mushrooms = pygame.sprite.Group()
-        self.fire_flowers = pygame.sprite.Group()
-        self.stars = pygame.sprite.Group()
-        self.oneup_mushrooms = pygame.sprite.Group()
-        self.coin_sprites = pygame.sprite.Group()
-        self.fireballs = pygame.sprite.Group()
+        # Everything that moves or is picked up meets in one broadphase sweep
+        self.broadphase = Broadphase()
+        self.enemies = KindGroup(self.broadphase, KIND_ENEMY)
+        self.mushrooms = KindGroup(self.broadphase, KIND_MUSHROOM)
+        self.fire_flowers = KindGroup(self.broadphase, KIND_FIRE_FLOWER)
+        self.stars = KindGroup(self.broadphase, KIND_STAR)
+        self.oneup_mushrooms = KindGroup(self.broadphase, KIND_ONEUP)
+        self.coin_sprites = SpriteIndex()
+        self.fireballs = KindGroup(self.broadphase, KIND_FIREBALL)
+        self.collision_grid = CollisionGrid()
+        # Moving bodies are stepped as one NumPy batch when vectorized
+        self.bodies = BodyEngine() if vectorized else None
+        self.activation = ActivationWindow(engine=self.bodies)
+        self.static_layer = StaticLayer()
+        # Fireballs and power-ups are reused once thrown away rather than built again
+        self.pools = {cls: SpritePool(cls, self.activation)
+                      for cls in (Fireball, Mushroom, FireFlower, Star, OneUpMushroom)}
+        self.pools[Fireball].prefill(FIREBALL_POOL_SIZE, 0, 0, 1)
+        # Everything that runs out after a while, fired only on the step it is due
+        self.timers = TimerWheel(rate=sim_rate)
+        # Block hits and breaks, handled as they happen instead of by scanning every block
+        self.events = EventBus()
+        self.events.subscribe(BlockHit, self.start_bounce)
+        self.events.subscribe(BlockHit, self.give_item)
+        self.events.subscribe(BrickBroken, self.break_brick)
+        self.bouncing = []  # Question blocks mid-bounce
         
         # Create player
-        self.mario = Mario(100, 400)
+        self.mario = Mario(*self.level.start, self.timers)
         self.all_sprites.add(self.mario)
+        self.broadphase.add(self.mario, KIND_MARIO)
         
         # Build level
         self.build_level()
         
         # Font
-        self.font = pygame.font.Font(None, 32)
+        self.font = get_font(32)
+        self.hud_text = TextCache(32)
+        self.life_icon = self.draw_life_icon()
+        
+        # Level clock
+        self.level_clock = self.timers.schedule(CLOCK_FRAMES, self.tick_clock)
+        
+        # Where moving sprites and the camera were before the last step
+        self.previous = {}
+        self.previous_camera = self.camera.camera.topleft
+        
+        # Restarts and respawns go back to this instead of rebuilding the game
+        self.start = self.snapshot()
+        
+        # Step API: what step() observes, and the progress rewards are measured from
+        if observation not in ("vector", "symbolic", "pixels"):
+            raise ValueError(f"unknown observation {observation!r}")
+        if observation != "vector" and np is None:
+            raise RuntimeError(f"{observation} observations need NumPy")
+        self.observation_mode = observation
+        self.downsample = downsample
+        if observation == "pixels":
+            # Draw into memory NumPy owns, so observations can view it without locking a surface
+            self.framebuffer = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 4), np.uint8)
+            # BGRA matches the sprites' pixel format, which keeps blits on the fast path
+            self.screen = pygame.image.frombuffer(self.framebuffer, (SCREEN_WIDTH, SCREEN_HEIGHT), "BGRA")
+            self.pixels = self.framebuffer[::downsample, ::downsample, 2::-1]
+        self.reward_score = self.score
+        self.best_x = self.mario.rect.x
+    
+    def reset(self):
+        """Start over from the beginning for step(); returns the first observation"""
+        if not isinstance(self.input, ActionInput):
+            self.input = ActionInput()
+        self.restore(self.start)
+        self.running = True
+        self.reward_score = self.score
+        self.best_x = self.mario.rect.x
+        return self.observe()
+    
+    def advance(self, action):
+        """Run exactly one update holding action's keys; returns (reward, done)"""
+        if not isinstance(self.input, ActionInput):
+            # Otherwise the keyboard or script would play and the action be ignored
+            raise RuntimeError("call reset() before step() so actions drive the game")
+        self.input.action = action
+        self.handle_events()
+        self.update()
+        
+        # Reward rightward progress and points scored
+        x = self.mario.rect.x
+        reward = max(0, x - self.best_x) + (self.score - self.reward_score) / 100
+        self.best_x = max(self.best_x, x)
+        self.reward_score = self.score
+        return reward, not self.running
+    
+    def step(self, action):
+        """Advance one frame; returns (observation, reward, done)"""
+        reward, done = self.advance(action)
+        return self.observe(), reward, done
+    
+    def observe(self):
+        """Observation in the mode the game was created with"""
+        if self.observation_mode == "pixels":
+            # Always the same (height, width, 3) view, refreshed in place
+            self.draw()
+            return self.pixels
+        if self.observation_mode == "symbolic":
+            return self.symbolic_grid()
+        if np is not None:
+            vector = np.empty(len(OBSERVATION_FIELDS), np.float32)
+        else:
+            vector = [0.0] * len(OBSERVATION_FIELDS)
+        observe(self, vector)
+        return vector
+    
+    def symbolic_grid(self):
+        """Tile codes for the SYMBOLIC_ROWS x SYMBOLIC_COLUMNS tiles around Mario, no drawing needed"""
+        grid = np.zeros((SYMBOLIC_ROWS, SYMBOLIC_COLUMNS), np.int8)
+        first = self.mario.rect.centerx // TILE_SIZE - SYMBOLIC_COLUMNS // 2
+        
+        # Terrain straight from the collision grid
+        cells = self.collision_grid.cells
+        for column in range(SYMBOLIC_COLUMNS):
+            for row in range(SYMBOLIC_ROWS):
+                bucket = cells.get((first + column, row))
+                if bucket:
+                    terrain = any(layer & TERRAIN for _, layer, _ in bucket)
+                    grid[row, column] = SYMBOLIC_TERRAIN if terrain else SYMBOLIC_BLOCK
+        
+        # Enemies and pickups from the sprites in range
+        left = first * TILE_SIZE
+        for sprite in self.all_sprites.visible(left, left + SYMBOLIC_COLUMNS * TILE_SIZE):
+            if isinstance(sprite, Goomba):
+                if not sprite.is_alive:
+                    continue
+                code = SYMBOLIC_ENEMY
+            elif isinstance(sprite, (Coin, Mushroom, FireFlower, Star, OneUpMushroom)):
+                code = SYMBOLIC_PICKUP
+            elif sprite is self.mario:
+                code = SYMBOLIC_MARIO
+            else:
+                continue
+            column = sprite.rect.centerx // TILE_SIZE - first
+            row = sprite.rect.centery // TILE_SIZE
+            if 0 <= column < SYMBOLIC_COLUMNS and 0 <= row < SYMBOLIC_ROWS:
+                grid[row, column] = code
+        return grid
+    
+    def snapshot(self):
+        """Capture the game state as a Checkpoint"""
+        return Checkpoint(self)
+    
+    def restore(self, checkpoint):
+        """Put a Checkpoint back in place, reusing every sprite, surface and the display"""
+        self.score, self.coins, self.lives, self.time_left, now, self.level_clock = checkpoint.values
+        self.timers.clear(now)
+        self.timers.rearm(self)
+        self.restore_mario(checkpoint)
+        
+        if self.stream is not None:
+            self.restore_stream(checkpoint)
+        self.restore_sprites(checkpoint)
+        if self.stream is not None:
+            self.restore_terrain(checkpoint)
+        
+        self.events.clear()
+        self.bouncing = [block for block in self.question_blocks if block.bouncing]
         
-        # Timer
-        self.timer_counter = 0
+        self.camera.update(self.mario)
+        self.previous = {}
+        self.previous_camera = self.camera.camera.topleft
+    
+    def restore_mario(self, checkpoint):
+        # Power-ups running out now must not cut short the ones restored
+        self.timers.release(self.mario)
+        Checkpoint.apply(self.mario, checkpoint.mario)
+        self.timers.rearm(self.mario)
+        self.mario.draw_mario()
+    
+    def restore_sprites(self, checkpoint):
+        # Bodies go back into the engine only once their velocity is restored
+        if self.bodies is not None:
+            for sprite in list(self.bodies.sprites):
+                self.bodies.remove(sprite)
+        
+        blocks = {block: (block.is_active, tuple(block.rect)) for block in self.question_blocks}
+        squashed = {enemy: enemy.squashed for enemy in checkpoint.sprites if isinstance(enemy, Goomba)}
+        for sprite, saved in checkpoint.sprites.items():
+            Checkpoint.apply(sprite, saved)
+        self.timers.rearm(*checkpoint.sprites)
+        
+        # Group membership, touching only what changed
+        for name, sprites in checkpoint.groups.items():
+            group = getattr(self, name)
+            keep = set(sprites)
+            group.remove(*[sprite for sprite in group if sprite not in keep])
+            group.add(*[sprite for sprite in sprites if sprite not in group])
+        self.activation.dormant = list(checkpoint.dormant)
+        self.activation.active = dict(checkpoint.active)
+        if self.bodies is not None:
+            for sprite in self.activation.active:
+                self.bodies.add(sprite)
+        
+        # Terrain: broken bricks come back, hit blocks go back to how they looked
+        for brick in self.bricks:
+            if brick not in self.collision_grid.entries:
+                self.collision_grid.add(brick, BLOCKS)
+                self.static_layer.add(brick)
+        for block, (active, rect) in blocks.items():
+            if block.is_active != active or tuple(block.rect) != rect:
+                block.draw()
+                self.collision_grid.move(block)
+                self.static_layer.refresh(block)
+        for enemy, was_squashed in squashed.items():
+            if enemy.squashed != was_squashed:
+                enemy.draw()
+    
+    def restore_stream(self, checkpoint):
+        # Release the chunks built since the checkpoint, or rebuilt since it released them
+        for index, records in list(self.stream.resident.items()):
+            if checkpoint.resident.get(index) is not records:
+                self.stream.release(self, index)
+        self.stream.spent = set(checkpoint.spent)
+        self.stream.used = set(checkpoint.used)
+    
+    def restore_terrain(self, checkpoint):
+        """Put back the terrain of chunks the checkpoint had that were released since"""
+        for index, records in checkpoint.resident.items():
+            if index in self.stream.resident:
+                continue
+            self.stream.resident[index] = records
+            for _, sprite in records:
+                if isinstance(sprite, Ground):
+                    self.platforms.append(sprite)
+                    self.collision_grid.add(sprite)
+                elif isinstance(sprite, Pipe):
+                    self.collision_grid.add(sprite)
+                elif isinstance(sprite, QuestionBlock):
+                    sprite.draw()
+                    self.collision_grid.add(sprite, BLOCKS)
+                else:
+                    # Bricks came back with their group; coins and enemies are not terrain
+                    continue
+                self.static_layer.add(sprite)
     
     def build_level(self):
-        """Build the level"""
-        # Ground
-        ground = Ground(0, 550, self.level_width, 50)
-        self.platforms.append(ground)
-        self.all_sprites.add(ground)
-        
-        # Floating platforms
-        platform_positions = [
-            (300, 450, 128, 16),
-            (500, 380, 96, 16),
-            (700, 450, 128, 16),
-            (1000, 400, 160, 16),
-            (1300, 350, 96, 16),
-            (1600, 400, 128, 16),
-            (1900, 320, 160, 16),
-            (2200, 400, 128, 16),
-            (2600, 350, 160, 16),
-            (3000, 400, 96, 16),
-            (3300, 300, 128, 16),
-            (3600, 380, 160, 16),
-            (4000, 320, 128, 16),
-            (4300, 400, 96, 16),
-        ]
-        
-        for x, y, w, h in platform_positions:
-            platform = Ground(x, y, w, h)
-            self.platforms.append(platform)
-            self.all_sprites.add(platform)
-        
-        # Question blocks
-        qblock_positions = [
-            (400, 350, "coin"),
-            (432, 350, "mushroom"),
-            (464, 350, "coin"),
-            (800, 350, "fire_flower"),
-            (1100, 300, "coin"),
-            (1400, 250, "mushroom"),
-            (1700, 300, "1up"),
-            (2000, 220, "coin"),
-            (2300, 300, "star"),
-            (2700, 250, "coin"),
-            (3100, 300, "fire_flower"),
-            (3400, 200, "coin"),
-            (3700, 280, "mushroom"),
-            (4100, 220, "1up"),
-        ]
-        
-        for x, y, item in qblock_positions:
-            block = QuestionBlock(x, y, item)
-            self.question_blocks.add(block)
-            self.all_sprites.add(block)
-        
-        # Bricks
-        brick_positions = [
-            (368, 350), (496, 350), (528, 350),
-            (768, 350), (832, 350), (864, 350),
-            (1200, 300), (1232, 300),
-            (2100, 220), (2132, 220),
-            (2800, 250), (2832, 250),
-            (3500, 200), (3532, 200),
-        ]
-        
-        for x, y in brick_positions:
-            brick = Brick(x, y)
-            self.bricks.add(brick)
-            self.all_sprites.add(brick)
-        
-        # Pipes
-        pipe_positions = [
-            (600, 486, 64),
-            (1500, 454, 96),
-            (2400, 454, 96),
-            (3200, 486, 64),
-            (4200, 422, 128),
-        ]
-        
-        for x, y, h in pipe_positions:
-            pipe = Pipe(x, y, h)
-            self.pipes.add(pipe)
-            self.all_sprites.add(pipe)
-        
-        # Coins
-        coin_positions = [
-            (450, 300), (850, 300), (1150, 250),
-            (1750, 250), (2050, 170), (2350, 250),
-            (2750, 200), (3150, 250), (3450, 150),
-            (3750, 230), (4150, 170),
-        ]
-        
-        for x, y in coin_positions:
-            coin = Coin(x, y)
-            self.coin_sprites.add(coin)
-            self.all_sprites.add(coin)
-        
-        # Goombas
-        goomba_positions = [
-            (700, 518), (950, 518), (1250, 518),
-            (1800, 518), (2100, 518), (2500, 518),
-            (2900, 518), (3400, 518), (3800, 518),
-            (4300, 518),
-        ]
-        
-        for x, y in goomba_positions:
-            goomba = Goomba(x, y)
-            self.enemies.add(goomba)
-            self.all_sprites.add(goomba)
+        """Build the level from its records"""
+        for record in self.level.records:
+            self.add_record(*record)
         
         # Flag at end
-        self.flag = Flag(self.level_width - 200, 230)
+        self.flag = Flag(*self.level.flag)
         self.all_sprites.add(self.flag)
+        
+        # Streamed levels build the chunks around the start instead
+        if self.stream is not None:
+            view_left = -self.camera.camera.x
+            self.stream.update(self, view_left, view_left + SCREEN_WIDTH)
+        
+        # Pre-render the terrain
+        self.static_layer.bake_all()
+    
+    def add_record(self, kind, item, x, y, w, h):
+        """Create the sprite for one level record"""
+        kind = LEVEL_KINDS[kind]
+        if kind == "ground":
+            sprite = Ground(x, y, w, h)
+            self.platforms.append(sprite)
+            self.collision_grid.add(sprite)
+            self.static_layer.add(sprite)
+        elif kind == "block":
+            sprite = QuestionBlock(x, y, self.events, BLOCK_ITEMS[item])
+            self.question_blocks.add(sprite)
+            self.collision_grid.add(sprite, BLOCKS)
+            self.static_layer.add(sprite)
+        elif kind == "brick":
+            sprite = Brick(x, y, self.events)
+            self.bricks.add(sprite)
+            self.collision_grid.add(sprite, BLOCKS)
+            self.static_layer.add(sprite)
+        elif kind == "pipe":
+            sprite = Pipe(x, y, h)
+            self.pipes.add(sprite)
+            self.collision_grid.add(sprite)
+            self.static_layer.add(sprite)
+        elif kind == "coin":
+            sprite = Coin(x, y)
+            self.coin_sprites.add(sprite)
+            self.all_sprites.add(sprite)
+        elif kind == "goomba":
+            sprite = Goomba(x, y)
+            self.activation.add(sprite, self.enemies, self.all_sprites)
+        elif kind == "mushroom":
+            # Power-ups pop out above the block they spawn from; loose ones sit at (x, y)
+            sprite = Mushroom(x, y + 32)
+            self.activation.add(sprite, self.mushrooms, self.all_sprites)
+        return sprite
+    
+    def remove_record(self, sprite):
+        """Take a record's sprite out of the game, e.g. when its chunk is released"""
+        self.activation.discard(sprite)
+        sprite.kill()
+        if sprite in self.collision_grid.entries:
+            self.collision_grid.remove(sprite)
+        if sprite in self.static_layer.spans:
+            self.static_layer.remove(sprite)
+        if isinstance(sprite, Ground):
+            self.platforms.remove(sprite)
+        if sprite in self.bouncing:
+            self.bouncing.remove(sprite)
+    
+    def record_spent(self, sprite):
+        """Whether a record's sprite has been used up and should not be built again"""
+        if isinstance(sprite, Brick):
+            return sprite.broken
+        if isinstance(sprite, Goomba) and not sprite.is_alive:
+            return True
+        if isinstance(sprite, (Coin, Goomba, Mushroom)):
+            return not sprite.alive() and sprite not in self.activation
+        return False
     
     def handle_events(self):
         """Handle game events"""
+        if self.allocations is not None:
+            self.allocations.frame()
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        pressed = []
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.running = False
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE or event.key == pygame.K_UP:
-                    self.mario.jump()
-                if event.key == pygame.K_x or event.key == pygame.K_LCTRL:
-                    # Shoot fireball
-                    fireball = self.mario.shoot_fireball()
-                    if fireball:
-                        self.fireballs.add(fireball)
-                        self.all_sprites.add(fireball)
+                pressed.append(event.key)
+        
+        # Scripted input reports its presses here instead of through events
+        pressed.extend(self.input.advance())
+        
+        if self.recorder is not None:
+            self.recorder.record(self, self.input.get_pressed(), pressed)
+        for key in pressed:
+            self.handle_key_down(key)
+        if profiler is not None:
+            profiler.lap("input")
+    
+    def handle_key_down(self, key):
+        """Handle a key press"""
+        if key == pygame.K_SPACE or key == pygame.K_UP:
+            self.mario.jump()
+        if key == pygame.K_x or key == pygame.K_LCTRL:
+            # Shoot fireball
+            fireball = self.mario.shoot_fireball(self.pools[Fireball])
+            if fireball:
+                fireball.phase = self.timers.frame
+                self.activation.spawn(fireball, self.fireballs, self.all_sprites)
+                # A reused fireball's old timer must not burn the new shot out early
+                fireball.expiry = self.timers.reschedule(fireball.expiry, FIREBALL_LIFETIME,
+                                                         self.despawn, fireball)
+        if key == pygame.K_F3:
+            self.toggle_profiler()
+    
+    def toggle_profiler(self):
+        """Show or hide the profiler overlay; profiling stops with it unless it streams to CSV"""
+        profiler = self.profiler
+        if profiler is None:
+            self.profiler = FrameProfiler()
+        elif profiler.csv_file is None:
+            self.profiler = None
+        else:
+            profiler.overlay = not profiler.overlay
     
     def update(self):
         """Update game state"""
-        # Update timer
-        self.timer_counter += 1
-        if self.timer_counter >= 60:
-            self.time_left -= 1
-            self.timer_counter = 0
-            if self.time_left <= 0:
-                self.lives -= 1
-                self.reset_level()
+        profiler = self.profiler
         
-        # Update Mario
-        all_platforms = (self.platforms + 
-                        list(self.question_blocks) + 
-                        list(self.bricks) + 
-                        list(self.pipes))
+        # Fire the timers due this frame: the level clock, power-ups running out, despawns
+        self.timers.advance()
+        if profiler is not None:
+            profiler.lap("timer")
         
-        result = self.mario.update(all_platforms, 
-                                   list(self.question_blocks),
-                                   list(self.bricks),
-                                   list(self.pipes))
+        # Update Mario
+        result = self.mario.update(self.collision_grid, self.input.get_pressed(), self.dt)
         
         if result == "dead":
             self.lives -= 1
             self.reset_level()
+        if profiler is not None:
+            profiler.lap("mario")
         
         # Update camera
         self.camera.update(self.mario)
         
-        # Update question blocks and spawn power-ups
-        for block in self.question_blocks:
-            block.update()
-            
-        # Check which blocks were just hit
-        for block in self.question_blocks:
-            if hasattr(block, '_just_hit') and block._just_hit:
-                item = block.item_type
-                if item == "mushroom":
-                    mushroom = Mushroom(block.rect.x, block.rect.y)
-                    self.mushrooms.add(mushroom)
-                    self.all_sprites.add(mushroom)
-                elif item == "fire_flower":
-                    flower = FireFlower(block.rect.x, block.rect.y)
-                    self.fire_flowers.add(flower)
-                    self.all_sprites.add(flower)
-                elif item == "star":
-                    star = Star(block.rect.x, block.rect.y)
-                    self.stars.add(star)
-                    self.all_sprites.add(star)
-                elif item == "1up":
-                    oneup = OneUpMushroom(block.rect.x, block.rect.y)
-                    self.oneup_mushrooms.add(oneup)
-                    self.all_sprites.add(oneup)
-                elif item == "coin":
-                    self.coins += 1
-                    self.score += 100
-                block._just_hit = False
+        # Build and release streamed chunks around the camera
+        view_left = -self.camera.camera.x
+        if self.stream is not None:
+            self.stream.update(self, view_left, view_left + SCREEN_WIDTH)
+        
+        # Wake entities near the camera and park those far from it
+        self.activation.update(view_left, view_left + SCREEN_WIDTH)
+        if profiler is not None:
+            profiler.lap("camera")
+        
+        # React to the blocks Mario hit: spawn power-ups, score coins, remove broken bricks
+        self.events.dispatch()
+        if profiler is not None:
+            profiler.lap("events")
+        
+        # Bounce the question blocks that were hit
+        for block in self.bouncing:
+            block.update(self.timers.frame)
+            # Keep the grid and terrain in step with the block as it bounces
+            self.collision_grid.move(block)
+            self.static_layer.refresh(block)
+        if self.bouncing:
+            self.bouncing = [block for block in self.bouncing if block.bouncing]
+        if profiler is not None:
+            profiler.lap("blocks")
+        
+        # Move every awake body at once; their updates below only animate
+        if self.bodies is not None:
+            self.bodies.step(self.collision_grid, self.dt)
+            if profiler is not None:
+                profiler.lap("bodies")
         
         # Update enemies
         for enemy in self.enemies:
-            enemy.update(self.platforms + list(self.pipes))
+            enemy.update(self.collision_grid, self.dt)
+        if profiler is not None:
+            profiler.lap("enemies")
         
         # Update mushrooms
         for mushroom in self.mushrooms:
-            mushroom.update(self.platforms + list(self.pipes))
+            mushroom.update(self.collision_grid, self.dt)
         
         # Update fire flowers
         for flower in self.fire_flowers:
-            flower.update(self.platforms + list(self.pipes))
+            flower.update(self.collision_grid, self.dt)
         
         # Update stars
         for star in self.stars:
-            star.update(self.platforms + list(self.pipes))
+            star.update(self.collision_grid, self.dt)
         
         # Update 1-up mushrooms
         for oneup in self.oneup_mushrooms:
-            oneup.update(self.platforms + list(self.pipes))
+            oneup.update(self.collision_grid, self.dt)
         
-        # Update coins
-        for coin in self.coin_sprites:
-            coin.update()
+        # Coins never change; they bob only as they are drawn
         
         # Update fireballs
         for fireball in self.fireballs:
-            fireball.update(self.platforms + list(self.pipes))
+            fireball.update(self.collision_grid, self.dt)
+        if profiler is not None:
+            profiler.lap("items")
+        
+        # Every overlap between moving sprites, found in one sweep
+        pairs = self.broadphase.sweep()
+        mario_rect = tuple(self.mario.rect)
+        
+        def mario_hits(kind, group, dokill):
+            """What Mario touches in group, like spritecollide(mario, group, dokill)"""
+            if tuple(self.mario.rect) != mario_rect:
+                # A power-up just resized him, so the sweep's pairs are out of date
+                return pygame.sprite.spritecollide(self.mario, group, dokill)
+            hits = in_group_order([sprite for _, sprite in pairs.get((KIND_MARIO, kind), ())
+                                   if sprite.alive()], group)
+            if dokill:
+                for sprite in hits:
+                    sprite.kill()
+            return hits
         
         # Check mushroom collection
-        mushroom_hits = pygame.sprite.spritecollide(self.mario, self.mushrooms, True)
+        mushroom_hits = mario_hits(KIND_MUSHROOM, self.mushrooms, True)
         if mushroom_hits:
             self.mario.power_up("super")
             self.score += 1000
         
         # Check fire flower collection
-        flower_hits = pygame.sprite.spritecollide(self.mario, self.fire_flowers, True)
+        flower_hits = mario_hits(KIND_FIRE_FLOWER, self.fire_flowers, True)
         if flower_hits:
             self.mario.power_up("fire")
             self.score += 1000
         
         # Check star collection
-        star_hits = pygame.sprite.spritecollide(self.mario, self.stars, True)
+        star_hits = mario_hits(KIND_STAR, self.stars, True)
         if star_hits:
             self.mario.power_up("star")
             self.score += 1000
         
         # Check 1-up collection
-        oneup_hits = pygame.sprite.spritecollide(self.mario, self.oneup_mushrooms, True)
+        oneup_hits = mario_hits(KIND_ONEUP, self.oneup_mushrooms, True)
         if oneup_hits:
             self.lives += 1
             self.score += 1000
         
-        # Check coin collection
-        coin_hits = pygame.sprite.spritecollide(self.mario, self.coin_sprites, True)
+        # Check coin collection among the coins level with Mario
+        rect = self.mario.rect
+        coin_hits = [coin for coin in self.coin_sprites.visible(rect.left, rect.right)
+                     if rect.colliderect(coin.rect)]
         for coin in coin_hits:
+            coin.kill()
             self.coins += 1
             self.score += 200
-        
-        # Check fireball hitting enemies
-        for fireball in self.fireballs:
-            enemy_hits = pygame.sprite.spritecollide(fireball, self.enemies, False)
-            for enemy in enemy_hits:
-                if enemy.is_alive:
-                    enemy.stomp()
-                    self.score += 100
-                    fireball.kill()
+        if profiler is not None:
+            profiler.lap("pickups")
+        
+        # Check fireball hitting enemies, fireball by fireball
+        burns = in_group_order(pairs.get((KIND_ENEMY, KIND_FIREBALL), []), self.enemies, key=lambda pair: pair[0])
+        for enemy, fireball in in_group_order(burns, self.fireballs, key=lambda pair: pair[1]):
+            if enemy.is_alive:
+                self.stomp(enemy)
+                self.score += 100
+                fireball.kill()
+        
+        # Goombas that walk into each other both turn around
+        for first, second in pairs.get((KIND_ENEMY, KIND_ENEMY), ()):
+            if first.is_alive and second.is_alive:
+                left, right = (first, second) if first.rect.centerx <= second.rect.centerx else (second, first)
+                left.velocity_x = -abs(left.velocity_x)
+                right.velocity_x = abs(right.velocity_x)
         
         # Check enemy collision
-        enemy_hits = pygame.sprite.spritecollide(self.mario, self.enemies, False)
+        enemy_hits = mario_hits(KIND_ENEMY, self.enemies, False)
         for enemy in enemy_hits:
             if enemy.is_alive and not enemy.squashed:
                 # Check if stomping
                 if self.mario.velocity_y > 0 and self.mario.rect.bottom < enemy.rect.centery:
-                    enemy.stomp()
+                    self.stomp(enemy)
                     self.mario.velocity_y = -8  # Bounce
                     self.score += 100
                 else:
                     # Hit by enemy - star power kills enemies
                     if self.mario.star_power:
-                        enemy.stomp()
+                        self.stomp(enemy)
                         self.score += 100
                     elif self.mario.take_damage():
                         self.lives -= 1
@@ -1259,36 +3585,152 @@ class Game:
         if self.mario.rect.colliderect(self.flag.rect):
             self.level_complete()
         
-        # Remove broken bricks
-        for brick in list(self.bricks):
-            if brick.broken:
-                brick.kill()
-                self.bricks.remove(brick)
-                self.score += 50
-        
         # Check lives
         if self.lives <= 0:
             self.game_over()
+        if profiler is not None:
+            profiler.lap("enemy_hits")
+            profiler.count("collision_tests", self.collision_grid.tests + self.broadphase.tests)
+        self.collision_grid.tests = 0
+        self.broadphase.tests = 0
     
-    def draw(self):
-        """Draw everything"""
+    def start_bounce(self, event):
+        event.block.bounce_start = self.timers.frame
+        self.bouncing.append(event.block)
+    
+    def give_item(self, event):
+        """Pop a block's power-up out above it, or score its coin"""
+        block, item = event.block, event.item
+        if item == "mushroom":
+            mushroom = self.pools[Mushroom].acquire(block.rect.x, block.rect.y)
+            self.activation.spawn(mushroom, self.mushrooms, self.all_sprites)
+        elif item == "fire_flower":
+            flower = self.pools[FireFlower].acquire(block.rect.x, block.rect.y)
+            self.activation.spawn(flower, self.fire_flowers, self.all_sprites)
+        elif item == "star":
+            star = self.pools[Star].acquire(block.rect.x, block.rect.y)
+            star.phase = self.timers.frame
+            self.activation.spawn(star, self.stars, self.all_sprites)
+        elif item == "1up":
+            oneup = self.pools[OneUpMushroom].acquire(block.rect.x, block.rect.y)
+            self.activation.spawn(oneup, self.oneup_mushrooms, self.all_sprites)
+        elif item == "coin":
+            self.coins += 1
+            self.score += 100
+    
+    def break_brick(self, event):
+        """Take a broken brick out of the level"""
+        brick = event.brick
+        brick.kill()
+        self.collision_grid.remove(brick)
+        self.static_layer.remove(brick)
+        self.score += 50
+    
+    def tick_clock(self):
+        """Take a second off the level clock"""
+        self.level_clock = self.timers.schedule(CLOCK_FRAMES, self.tick_clock)
+        self.time_left -= 1
+        if self.time_left <= 0:
+            self.lives -= 1
+            self.reset_level()
+    
+    @property
+    def timer_counter(self):
+        """Frames into the current second of the level clock"""
+        return CLOCK_FRAMES - self.timers.remaining(self.level_clock)
+    
+    def stomp(self, enemy):
+        """Squash an enemy, which lingers SQUASH_FRAMES before it is despawned"""
+        enemy.stomp()
+        enemy.removal = self.timers.schedule(SQUASH_FRAMES, self.despawn, enemy)
+    
+    def despawn(self, sprite):
+        """Take a sprite out of play for good, e.g. a burnt-out fireball"""
+        self.activation.discard(sprite)
+        sprite.kill()
+    
+    def state_checksum(self):
+        """CRC of the state that plays out the same streamed or not, to catch replays diverging"""
+        mario = self.mario
+        state = (
+            self.score, self.coins, self.lives, self.time_left, self.timer_counter,
+            tuple(mario.rect), mario.velocity_x, mario.velocity_y, mario.state,
+            mario.on_ground, mario.invincible_timer, mario.star_timer, mario.fireball_cooldown,
+            sorted((tuple(enemy.rect), enemy.is_alive) for enemy in self.enemies),
+            sorted(tuple(sprite.rect) for group in (self.mushrooms, self.fire_flowers, self.stars,
+                                                    self.oneup_mushrooms, self.fireballs)
+                   for sprite in group),
+        )
+        return zlib.crc32(repr(state).encode())
+    
+    def pool_stats(self):
+        """SpritePool.stats() for each pooled class, by class name"""
+        return {cls.__name__: pool.stats() for cls, pool in self.pools.items()}
+    
+    def remember_positions(self):
+        """Snapshot moving sprites and the camera before a step, for interpolation"""
+        self.previous = {sprite: sprite.rect.topleft for sprite in self.all_sprites.movers}
+        self.previous_camera = self.camera.camera.topleft
+    
+    def draw(self, alpha=1.0):
+        """Draw everything, alpha of the way from the previous step to the current one"""
+        offset_x, offset_y = self.camera.camera.topleft
+        if alpha < 1.0:
+            old_x, old_y = self.previous_camera
+            offset_x = round(old_x + (offset_x - old_x) * alpha)
+            offset_y = round(old_y + (offset_y - old_y) * alpha)
+        
+        profiler = self.profiler
+        
         # Sky
         self.screen.fill(SKY_BLUE)
+        if profiler is not None:
+            profiler.lap("sky")
         
         # Draw clouds
         for i in range(8):
-            x = i * 400 - (self.camera.camera.x // 2) % 400
+            x = i * 400 - (-offset_x // 2) % 400
             y = 80 + (i % 3) * 40
             self.draw_cloud(x, y)
-        
-        # Draw all sprites with camera offset
-        for sprite in self.all_sprites:
-            self.screen.blit(sprite.image, self.camera.apply(sprite))
+        if profiler is not None:
+            profiler.lap("clouds")
+        
+        # Draw the pre-baked terrain, then the sprites the camera can see
+        blits = self.static_layer.draw(self.screen, offset_x)
+        if profiler is not None:
+            profiler.lap("terrain")
+        previous = self.previous if alpha < 1.0 else {}
+        visible = self.all_sprites.visible(-offset_x, SCREEN_WIDTH - offset_x)
+        # Animated sprites pick their image from the frame clock rather than keeping one up to date
+        clock = self.timers.frame
+        for sprite in visible:
+            x, y = sprite.rect.topleft
+            if sprite in previous:
+                old_x, old_y = previous[sprite]
+                x = round(old_x + (x - old_x) * alpha)
+                y = round(old_y + (y - old_y) * alpha)
+            animate = getattr(sprite, "animate", None)
+            if animate is None:
+                image = sprite.image
+            else:
+                image, bob = animate(clock)
+                y += bob
+            self.screen.blit(image, (x + offset_x, y + offset_y))
+        if profiler is not None:
+            profiler.lap("sprites")
         
         # Draw HUD
-        self.draw_hud()
+        blits += self.draw_hud()
+        if profiler is not None:
+            profiler.lap("hud")
+            profiler.count("blits", blits + len(visible))
+            if profiler.overlay:
+                profiler.draw(self.screen)
+                profiler.lap("overlay")
         
         pygame.display.flip()
+        if profiler is not None:
+            profiler.lap("flip")
     
     def draw_cloud(self, x, y):
         """Draw a cloud"""
@@ -1297,20 +3739,36 @@ class Game:
         pygame.draw.ellipse(self.screen, WHITE, (x + 45, y + 5, 40, 25))
     
     def draw_hud(self):
-        """Draw the HUD"""
-        # Score
-        score_text = self.font.render(f"SCORE: {self.score:06d}", True, WHITE)
-        self.screen.blit(score_text, (10, 10))
+        """Draw the HUD; returns how many surfaces it blitted"""
+        text = self.hud_text
+        mario = self.mario
+        blits = [
+            # Score and coins
+            (text.render("SCORE: {:06d}", self.score), (10, 10)),
+            (text.render("COINS: {:02d}", self.coins), (10, 40)),
+            # Lives with visual hearts/Mario icons
+            (text.render("x {}", self.lives), (330, 10)),
+            (self.life_icon, (300, 8)),
+            # Time and world
+            (text.render("TIME: {:03d}", self.time_left), (600, 10)),
+            (text.render("WORLD {}", self.level.name), (300, 40)),
+        ]
         
-        # Coins
-        coin_text = self.font.render(f"COINS: {self.coins:02d}", True, WHITE)
-        self.screen.blit(coin_text, (10, 40))
+        # Power-up indicators
+        if mario.state == "fire":
+            blits.append((text.render("FIRE MARIO!", color=(255, 165, 0)), (10, 70)))
+        elif mario.state == "super":
+            blits.append((text.render("SUPER MARIO!", color=(0, 255, 0)), (10, 70)))
         
-        # Lives with visual hearts/Mario icons
-        lives_text = self.font.render(f"x {self.lives}", True, WHITE)
-        self.screen.blit(lives_text, (330, 10))
+        if mario.star_power:
+            blits.append((text.render("INVINCIBLE!", color=(255, 100, 0)), (602, 42)))
+            blits.append((text.render("INVINCIBLE!", color=QUESTION_YELLOW), (600, 40)))
         
-        # Draw Mario life icon
+        self.screen.blits(blits, doreturn=False)
+        return len(blits)
+    
+    def draw_life_icon(self):
+        """Draw the Mario head shown next to the lives count"""
         life_icon = pygame.Surface((24, 24), pygame.SRCALPHA)
         life_icon.fill((0, 0, 0, 0))
         # Mini Mario head
@@ -1318,43 +3776,20 @@ class Game:
         pygame.draw.ellipse(life_icon, (255, 220, 177), (6, 10, 12, 12))  # Face
         pygame.draw.circle(life_icon, BLACK, (10, 15), 1)  # Eye
         pygame.draw.circle(life_icon, BLACK, (14, 15), 1)  # Eye
-        self.screen.blit(life_icon, (300, 8))
-        
-        # Time
-        time_text = self.font.render(f"TIME: {self.time_left:03d}", True, WHITE)
-        self.screen.blit(time_text, (600, 10))
-        
-        # World
-        world_text = self.font.render("WORLD 1-1", True, WHITE)
-        self.screen.blit(world_text, (300, 40))
-        
-        # Power-up indicators
-        if self.mario.state == "fire":
-            power_text = self.font.render("FIRE MARIO!", True, (255, 165, 0))
-            self.screen.blit(power_text, (10, 70))
-        elif self.mario.state == "super":
-            power_text = self.font.render("SUPER MARIO!", True, (0, 255, 0))
-            self.screen.blit(power_text, (10, 70))
-        
-        if self.mario.star_power:
-            star_text = self.font.render("INVINCIBLE!", True, QUESTION_YELLOW)
-            star_shadow = self.font.render("INVINCIBLE!", True, (255, 100, 0))
-            self.screen.blit(star_shadow, (602, 42))
-            self.screen.blit(star_text, (600, 40))
+        return life_icon
     
     def reset_level(self):
         """Reset level after death"""
         if self.lives > 0:
-            self.mario.rect.x = 100
-            self.mario.rect.y = 400
-            self.mario.velocity_x = 0
-            self.mario.velocity_y = 0
-            self.mario.state = "small"
-            self.mario.draw_mario()
+            self.restore_mario(self.start)
             self.time_left = 400
     
     def level_complete(self):
         """Handle level completion"""
+        if self.headless:
+            self.running = False
+            return
+        
         self.screen.fill(BLACK)
         text = self.font.render("LEVEL COMPLETE!", True, WHITE)
         score_text = self.font.render(f"SCORE: {self.score}", True, WHITE)
@@ -1368,6 +3803,10 @@ class Game:
     
     def game_over(self):
         """Handle game over"""
+        if self.headless:
+            self.running = False
+            return
+        
         self.screen.fill(BLACK)
         text = self.font.render("GAME OVER", True, RED)
         score_text = self.font.render(f"FINAL SCORE: {self.score}", True, WHITE)
@@ -1387,24 +3826,381 @@ class Game:
                     waiting = False
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_r:
-                        self.__init__()  # Restart
+                        # The input log covers the first game only
+                        self.recorder = None
+                        self.restore(self.start)  # Restart
                         waiting = False
                     if event.key == pygame.K_q:
                         self.running = False
                         waiting = False
     
-    def run(self):
-        """Main game loop"""
+    def run(self, render_fps=FPS, speed=1.0, max_steps=MAX_CATCHUP_STEPS, stats=False,
+            record_path=None):
+        """Main game loop: fixed simulation steps, rendered as often as render_fps allows"""
+        # A restart stops recording, so the log ends with the first game
+        recorder = self.recorder
+        timestep = FixedTimestep(self.sim_rate, max_steps, speed)
+        pacing = FrameStats()
+        last = time.perf_counter()
         while self.running:
-            self.handle_events()
-            self.update()
-            self.draw()
-            self.clock.tick(FPS)
-        
+            now = time.perf_counter()
+            steps = timestep.advance(now - last)
+            interval, last = now - last, now
+            
+            # Simulate
+            for _ in range(steps):
+                self.remember_positions()
+                self.handle_events()
+                self.update()
+                if not self.running:
+                    break
+            if not steps:
+                # Keep the window responsive between steps
+                pygame.event.pump()
+            sim_done = time.perf_counter()
+            
+            # Render
+            self.draw(timestep.alpha)
+            draw_done = time.perf_counter()
+            pacing.record(interval, steps, sim_done - now, draw_done - sim_done)
+            
+            if render_fps:
+                self.clock.tick(render_fps)
+        
+        if stats:
+            pacing.report(timestep.dropped)
+        if self.profiler is not None:
+            self.profiler.close()
+        if self.allocations is not None:
+            self.allocations.report(self)
+            self.allocations.close()
+        if recorder is not None:
+            recorder.save(record_path)
         pygame.quit()
         sys.exit()
+    
+    def simulate(self, frames):
+        """Step the game as fast as the CPU allows, without waiting on the frame clock"""
+        start = time.perf_counter()
+        steps = 0
+        while self.running and steps < frames:
+            self.handle_events()
+            self.update()
+            if self.rendering:
+                self.draw()
+            steps += 1
+        if self.profiler is not None:
+            self.profiler.stop()
+        return steps, time.perf_counter() - start
+
+# Observation vector for vectorized environments, one float per field
+OBSERVATION_FIELDS = ("x", "y", "velocity_x", "velocity_y", "power", "on_ground", "lives", "time_left")
+POWER_LEVELS = ("small", "super", "fire")
+
+# Symbolic observations: a grid of tiles around Mario, one code per tile
+SYMBOLIC_COLUMNS = 16
+SYMBOLIC_ROWS = SCREEN_HEIGHT // TILE_SIZE + 1
+SYMBOLIC_EMPTY, SYMBOLIC_TERRAIN, SYMBOLIC_BLOCK, SYMBOLIC_ENEMY, SYMBOLIC_PICKUP, SYMBOLIC_MARIO = range(6)
+WORKER_TIMEOUT = 30.0  # Seconds a worker may take over one batch before it is restarted
+
+def observe(game, out):
+    """Write a game's observation vector into out"""
+    mario = game.mario
+    out[:] = (mario.rect.x, mario.rect.y, mario.velocity_x, mario.velocity_y,
+              POWER_LEVELS.index(mario.state), mario.on_ground, game.lives, game.time_left)
+
+def vector_env_worker(conn, names, first, count, settings):
+    """Step games first..first + count of a VectorEnv, reading and writing its shared memory"""
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    actions, observations, rewards, dones = VectorEnv.views(blocks, first + count)
+    games = [Game(headless=True, input_source=ActionInput(), **settings) for _ in range(count)]
+    try:
+        while True:
+            command = conn.recv()
+            if command == "close":
+                break
+            for slot, game in enumerate(games, first):
+                if command == "reset":
+                    game.reset()
+                    rewards[slot], dones[slot] = 0, False
+                else:
+                    rewards[slot], dones[slot] = game.advance(int(actions[slot]))
+                    if dones[slot]:
+                        game.reset()  # Finished games start over straight away
+                    if game.rendering:
+                        game.draw()
+                observe(game, observations[slot])
+            conn.send(command)
+    finally:
+        del actions, observations, rewards, dones
+        for block in blocks:
+            block.close()
+
+class VectorEnv:
+    """Independent headless games stepped in batches across a pool of forked worker processes
+
+    Actions, observations, rewards and done flags live in shared NumPy buffers,
+    so a step only sends each worker a one-word message.
+    """
+    def __init__(self, num_envs, workers=None, **settings):
+        if np is None:
+            raise RuntimeError("the vectorized environment needs NumPy")
+        self.num_envs = num_envs
+        # Game arguments: level, stream, vectorized; drawing is off unless asked for
+        self.settings = dict(settings, render=settings.get("render", False))
+        self.context = multiprocessing.get_context("fork")
+        self.blocks = [shared_memory.SharedMemory(create=True, size=size)
+                       for size in self.sizes(num_envs)]
+        self.actions, self.observations, self.rewards, self.dones = self.views(self.blocks, num_envs)
+        
+        workers = min(num_envs, workers or os.cpu_count() or 1)
+        bounds = [num_envs * index // workers for index in range(workers + 1)]
+        self.slices = list(zip(bounds, bounds[1:]))
+        self.workers = [None] * workers
+        for index in range(workers):
+            self.start_worker(index)
+    
+    @staticmethod
+    def sizes(num_envs):
+        return (num_envs * 4, num_envs * len(OBSERVATION_FIELDS) * 4, num_envs * 4, num_envs)
+    
+    @staticmethod
+    def views(blocks, num_envs):
+        """actions, observations, rewards and dones arrays over the shared memory blocks"""
+        actions, observations, rewards, dones = blocks
+        return (np.ndarray((num_envs,), np.int32, actions.buf),
+                np.ndarray((num_envs, len(OBSERVATION_FIELDS)), np.float32, observations.buf),
+                np.ndarray((num_envs,), np.float32, rewards.buf),
+                np.ndarray((num_envs,), np.bool_, dones.buf))
+    
+    def start_worker(self, index):
+        first, end = self.slices[index]
+        conn, child = self.context.Pipe()
+        names = [block.name for block in self.blocks]
+        process = self.context.Process(target=vector_env_worker, daemon=True,
+                                       args=(child, names, first, end - first, self.settings))
+        process.start()
+        child.close()
+        self.workers[index] = (process, conn)
+    
+    def restart_worker(self, index):
+        """Replace a crashed or stuck worker and start its games over"""
+        process, conn = self.workers[index]
+        process.kill()
+        process.join()
+        conn.close()
+        self.start_worker(index)
+        self.send(index, "reset")
+        self.receive(index, "reset")
+        first, end = self.slices[index]
+        self.dones[first:end] = True
+    
+    def send(self, index, command):
+        try:
+            self.workers[index][1].send(command)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Noticed when the reply never comes
+    
+    def receive(self, index, command):
+        """Wait for a worker to finish command; False if it died or hung instead"""
+        conn = self.workers[index][1]
+        try:
+            return conn.poll(WORKER_TIMEOUT) and conn.recv() == command
+        except (EOFError, ConnectionResetError):
+            return False
+    
+    def broadcast(self, command):
+        for index in range(len(self.workers)):
+            self.send(index, command)
+        for index in range(len(self.workers)):
+            if not self.receive(index, command):
+                self.restart_worker(index)
+    
+    def reset(self):
+        """Start every game over; returns the observations"""
+        self.broadcast("reset")
+        return self.observations
+    
+    def step(self, actions):
+        """Advance every game one frame; returns (observations, rewards, dones)
+
+        The arrays are the shared buffers themselves and are overwritten by the next step.
+        """
+        self.actions[:] = actions
+        self.broadcast("step")
+        return self.observations, self.rewards, self.dones
+    
+    def close(self):
+        for index, (process, conn) in enumerate(self.workers):
+            self.send(index, "close")
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+            conn.close()
+        
+        # Drop the array views before the memory under them goes
+        del self.actions, self.observations, self.rewards, self.dones
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def run_vector_env(num_envs, frames, workers=None, **settings):
+    """Step num_envs games with random actions for frames batches and report throughput"""
+    with VectorEnv(num_envs, workers, **settings) as env:
+        rng = np.random.default_rng(0)
+        env.reset()
+        start = time.perf_counter()
+        finished = 0
+        for _ in range(frames):
+            _, _, dones = env.step(rng.integers(0, len(ActionInput.keys), num_envs))
+            finished += int(dones.sum())
+        elapsed = time.perf_counter() - start
+    
+    steps = num_envs * frames
+    print(f"{steps} steps over {num_envs} games and {len(env.workers)} worker(s) in "
+          f"{elapsed:.2f}s: {steps / elapsed:.0f} steps/s, {finished} game(s) finished")
+    return steps, elapsed
+
+def replay(path, render=False, stream=False):
+    """Rerun a recorded input log at full speed; returns the first diverging frame or None"""
+    log = InputLog.load(path)
+    game = Game(headless=True, render=render, input_source=ReplayInput(log),
+                vectorized=log.vectorized, level=log.level, stream=stream, sim_rate=log.sim_rate)
+    start = time.perf_counter()
+    diverged = None
+    checksums = iter(log.checksums)
+    frame = 0
+    while game.running and frame < len(log.codes):
+        if frame % log.interval == 0 and game.state_checksum() != next(checksums):
+            diverged = frame
+            break
+        game.handle_events()
+        game.update()
+        if game.rendering:
+            game.draw()
+        frame += 1
+    elapsed = time.perf_counter() - start
+    
+    fps = frame / elapsed if elapsed else 0.0
+    status = "ok" if diverged is None else f"DIVERGED at frame {diverged}"
+    print(f"{path}: {frame} frames in {elapsed:.2f}s, {fps:.0f} frames/s: {status}")
+    return diverged
+
+def run_headless(frames, render=True, script=DEMO_SCRIPT, vectorized=False, level=DEFAULT_LEVEL,
+                 stream=False, profiler=None, allocations=None, sim_rate=SIM_RATE):
+    """Soak the simulation for a number of frames, starting a new game whenever one ends"""
+    total = 0
+    elapsed = 0.0
+    games = 0
+    startup = None
+    start = time.perf_counter()
+    if not stream and not isinstance(level, Level):
+        level = Level.load(level)
+    while total < frames:
+        game = Game(headless=True, render=render, input_source=ScriptedInput(script),
+                    vectorized=vectorized, level=level, stream=stream, profiler=profiler,
+                    allocations=allocations, sim_rate=sim_rate)
+        if startup is None:
+            startup = time.perf_counter() - start
+        steps, seconds = game.simulate(frames - total)
+        total += steps
+        elapsed += seconds
+        games += 1
+    
+    fps = total / elapsed if elapsed else 0.0
+    print(f"{total} frames in {elapsed:.2f}s over {games} game(s): "
+          f"{fps:.0f} frames/s, {fps / sim_rate:.1f}x real time; "
+          f"first game ready in {startup * 1000:.1f}ms (art: {ASSETS.hits} cached, {ASSETS.misses} drawn)")
+    if profiler is not None:
+        profiler.report()
+        profiler.close()
+    if allocations is not None:
+        allocations.report(game)
+        allocations.close()
+    return total, elapsed
 
 # Run the game
 if __name__ == "__main__":
-    game = Game()
-    game.run()
+    parser = argparse.ArgumentParser(description="Super Mario Bros")
+    parser.add_argument("--headless", action="store_true",
+                        help="run the simulation without a window at full speed")
+    parser.add_argument("--frames", type=int, default=FPS * 60 * 10,
+                        help="frames to simulate in headless mode")
+    parser.add_argument("--no-render", action="store_true",
+                        help="skip drawing entirely in headless mode")
+    parser.add_argument("--level", default=DEFAULT_LEVEL,
+                        help="level name in levels/ or path to a .level file")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream the level from its memory-mapped file a chunk at a time")
+    parser.add_argument("--compile-levels", action="store_true",
+                        help="compile every level in levels/ and exit")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="step moving bodies as NumPy arrays (needs NumPy)")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record this game's input to an input log")
+    parser.add_argument("--replay", metavar="PATH", nargs="+",
+                        help="rerun recorded input logs headless at full speed")
+    parser.add_argument("--envs", type=int,
+                        help="run this many games in parallel with random actions for --frames steps")
+    parser.add_argument("--workers", type=int,
+                        help="worker processes for --envs (default: one per core)")
+    parser.add_argument("--sim-rate", type=int, default=SIM_RATE,
+                        help="simulation steps per second; physics and timers scale to match")
+    parser.add_argument("--render-fps", type=int, default=FPS,
+                        help="frame rate cap for drawing, 0 for uncapped")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="fast-forward multiplier for the simulation")
+    parser.add_argument("--max-steps", type=int, default=MAX_CATCHUP_STEPS,
+                        help="most simulation steps to catch up on per frame")
+    parser.add_argument("--no-asset-cache", action="store_true",
+                        help="draw sprite art from scratch instead of loading it from .cache/")
+    parser.add_argument("--pacing", action="store_true",
+                        help="print frame-pacing statistics on exit")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every phase of each frame; F3 toggles the overlay in a window")
+    parser.add_argument("--profile-csv", metavar="PATH",
+                        help="stream per-frame phase timings and counters to a CSV file")
+    parser.add_argument("--allocations", action="store_true",
+                        help="report allocations per frame by call site (slow, debug only)")
+    parser.add_argument("--allocation-budget", type=float, metavar="COUNT",
+                        help="with --allocations, fail a headless run making more allocations per frame")
+    args = parser.parse_args()
+    if args.no_asset_cache:
+        ASSETS.directory = None
+    profiler = None
+    if args.profile or args.profile_csv:
+        profiler = FrameProfiler(args.profile_csv, overlay=not args.headless)
+    allocations = AllocationTracker() if args.allocations else None
+    
+    if args.compile_levels:
+        for name in level_names():
+            level = compile_level(os.path.join(LEVEL_DIR, name + LEVEL_SOURCE))
+            print(f"{name}: {len(level.records)} records")
+    elif args.envs:
+        run_vector_env(args.envs, args.frames, args.workers, level=args.level,
+                       stream=args.stream, vectorized=args.vectorized, sim_rate=args.sim_rate)
+    elif args.replay:
+        diverged = [path for path in args.replay
+                    if replay(path, render=not args.no_render, stream=args.stream) is not None]
+        sys.exit(1 if diverged else 0)
+    elif args.headless:
+        run_headless(args.frames, render=not args.no_render, vectorized=args.vectorized,
+                     level=args.level, stream=args.stream, profiler=profiler,
+                     allocations=allocations, sim_rate=args.sim_rate)
+        if allocations is not None and args.allocation_budget is not None:
+            sys.exit(1 if allocations.per_frame()[0] > args.allocation_budget else 0)
+    else:
+        recorder = None
+        if args.record:
+            recorder = InputLog(args.level, args.vectorized, sim_rate=args.sim_rate)
+        game = Game(vectorized=args.vectorized, level=args.level, stream=args.stream,
+                    recorder=recorder, profiler=profiler, allocations=allocations,
+                    sim_rate=args.sim_rate)
+        game.run(render_fps=args.render_fps, speed=args.speed, max_steps=args.max_steps,
+                 stats=args.pacing, record_path=args.record)
@@ -0,0 +1,29 @@
+"""Shared fixtures: the game module, loaded from its file, and headless games"""
+import importlib.util
+import os
+
+import pytest
+
+GAME_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "mario_game (1).py")
+
+# Tests never need a real window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+def load_game():
+    """Import the game module from its file"""
+    spec = importlib.util.spec_from_file_location("mario_game", GAME_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture(scope="session")
+def mg():
+    return load_game()
+
+@pytest.fixture
+def game(mg):
+    """A headless game on the stock level that draws nothing and gets no input"""
+    return mg.Game(headless=True, render=False, input_source=mg.ScriptedInput([], loop=False))
@@ -0,0 +1,87 @@
+import pygame
+
+def tile(x, y, w=32, h=32):
+    sprite = pygame.sprite.Sprite()
+    sprite.rect = pygame.Rect(x, y, w, h)
+    return sprite
+
+def cells_of(grid, sprite):
+    return [cell for cell, bucket in grid.cells.items() if any(entry[2] is sprite for entry in bucket)]
+
+def test_query_keeps_insertion_order_and_filters_layers(mg):
+    grid = mg.CollisionGrid()
+    ground = tile(0, 512, 320, 64)
+    block = tile(64, 384)
+    pipe = tile(32, 448, 64, 64)
+    grid.add(ground)
+    grid.add(block, mg.BLOCKS)
+    grid.add(pipe)
+
+    area = pygame.Rect(0, 380, 160, 200)
+    assert grid.query(area) == [ground, block, pipe]
+    assert grid.query(area, mg.TERRAIN) == [ground, pipe]
+    assert grid.query(pygame.Rect(600, 0, 32, 32)) == []
+
+def test_move_refreshes_only_the_moved_sprites_cells(mg):
+    grid = mg.CollisionGrid()
+    block = tile(64, 384)
+    neighbour = tile(96, 384)
+    grid.add(block, mg.BLOCKS)
+    grid.add(neighbour, mg.BLOCKS)
+    version = grid.version
+
+    block.rect.y -= 40  # Into the row of cells above
+    grid.move(block)
+
+    assert grid.version > version
+    assert sorted(cells_of(grid, block)) == sorted(grid.cell_range(block.rect))
+    assert cells_of(grid, neighbour) == [(3, 12)]
+    assert grid.query(pygame.Rect(64, 400, 32, 16)) == []
+    # A moved sprite keeps its place in query order
+    assert grid.query(pygame.Rect(64, 340, 64, 80)) == [block, neighbour]
+
+def test_remove_drops_empty_cells(mg):
+    grid = mg.CollisionGrid()
+    brick = tile(64, 384)
+    grid.add(brick, mg.BLOCKS)
+    version = grid.version
+
+    grid.remove(brick)
+
+    assert grid.version > version
+    assert grid.cells == {}
+    assert brick not in grid.entries
+
+def test_broken_brick_leaves_the_grid(mg, game):
+    grid = game.collision_grid
+    brick = next(brick for brick in game.bricks if brick.breakable)
+    rect = brick.rect.copy()
+    others = [sprite for sprite in grid.query(rect) if sprite is not brick]
+    version = grid.version
+
+    brick.hit()
+    game.events.dispatch()
+
+    assert brick not in grid.entries
+    assert cells_of(grid, brick) == []
+    assert grid.query(rect) == others
+    assert grid.version > version
+
+def test_bouncing_block_moves_with_its_rect(mg, game):
+    grid = game.collision_grid
+    block = next(iter(game.question_blocks))
+    rest = block.rect.copy()
+
+    block.hit()
+    heights = []
+    while True:
+        game.update()
+        heights.append(block.rect.y)
+        assert sorted(cells_of(grid, block)) == sorted(grid.cell_range(block.rect))
+        assert block in grid.query(block.rect, mg.BLOCKS)
+        if not block.bouncing:
+            break
+
+    assert min(heights) < rest.y
+    assert block.rect == rest
+    assert block not in game.bouncing
@@ -0,0 +1,83 @@
+import struct
+
+import pygame
+import pytest
+
+def test_codes_pack_held_keys_below_presses(mg):
+    held = mg.ScriptedKeys({pygame.K_LEFT, pygame.K_x})
+    code = mg.InputLog.encode(held, [pygame.K_SPACE])
+    count = len(mg.RECORDED_KEYS)
+    assert code == 1 << 0 | 1 << 4 | 1 << (2 + count)
+    assert mg.InputLog.decode(code) == (held, [pygame.K_SPACE])
+
+def test_every_code_round_trips(mg):
+    for code in range(1 << (2 * len(mg.RECORDED_KEYS))):
+        assert mg.InputLog.encode(*mg.InputLog.decode(code)) == code
+
+def test_file_layout(mg, tmp_path):
+    log = mg.InputLog("1-2", vectorized=True, interval=2, sim_rate=120)
+    log.codes = [0, 0, 0, 5, 5, 0]
+    log.checksums = [11, 22, 33]
+    path = tmp_path / "run.log"
+    log.save(path)
+
+    expected = b"".join([
+        struct.pack("<4sHBxIIII", b"MINP", 2, 1, 120, 6, 2, 3),
+        struct.pack("<H", 3), b"1-2",
+        struct.pack("<3I", 11, 22, 33),
+        struct.pack("<HH", 3, 0), struct.pack("<HH", 2, 5), struct.pack("<HH", 1, 0),
+    ])
+    assert path.read_bytes() == expected
+
+def test_save_load_round_trip_splits_long_runs(mg, tmp_path):
+    log = mg.InputLog("1-1", interval=mg.CHECKSUM_INTERVAL)
+    log.codes = [3] * 70000 + [0] * 5 + [3]
+    log.checksums = [0xFFFFFFFF, 0, 12345]
+    path = tmp_path / "run.log"
+    log.save(path)
+
+    back = mg.InputLog.load(path)
+    assert (back.level, back.vectorized, back.interval, back.sim_rate) == ("1-1", False, 60, 60)
+    assert back.codes == log.codes
+    assert back.checksums == log.checksums
+
+def test_load_rejects_other_versions_and_truncation(mg, tmp_path):
+    log = mg.InputLog("1-1")
+    log.codes = [1, 2, 3]
+    path = tmp_path / "run.log"
+    log.save(path)
+    data = path.read_bytes()
+
+    path.write_bytes(data[:4] + struct.pack("<H", 1) + data[6:])
+    with pytest.raises(ValueError, match="not a version 2 input log"):
+        mg.InputLog.load(path)
+    path.write_bytes(data[:-4])
+    with pytest.raises(ValueError, match="truncated"):
+        mg.InputLog.load(path)
+
+def recorded_run(mg, path, frames=600, **settings):
+    """Record a scripted run that runs, jumps and shoots, and save its log to path"""
+    script = ([{pygame.K_RIGHT}] * 25 + [{pygame.K_RIGHT, pygame.K_SPACE}] * 5 +
+              [{pygame.K_LEFT}] * 10 + [{pygame.K_x}] * 2 + [set()] * 3)
+    log = mg.InputLog(mg.DEFAULT_LEVEL, settings.get("vectorized", False),
+                      sim_rate=settings.get("sim_rate", mg.SIM_RATE))
+    game = mg.Game(headless=True, render=False, input_source=mg.ScriptedInput(script),
+                   recorder=log, **settings)
+    game.simulate(frames)
+    log.save(path)
+    return log
+
+@pytest.mark.parametrize("sim_rate", [60, 120])
+def test_replay_matches_every_checksum(mg, tmp_path, sim_rate):
+    path = tmp_path / "run.log"
+    log = recorded_run(mg, path, sim_rate=sim_rate)
+    assert len(log.checksums) == 10
+    assert len(set(log.checksums)) > 1
+    assert mg.replay(path, render=False) is None
+
+def test_replay_reports_the_first_diverging_checksum(mg, tmp_path):
+    path = tmp_path / "run.log"
+    log = recorded_run(mg, path)
+    log.checksums[4] ^= 1
+    log.save(path)
+    assert mg.replay(path, render=False) == 4 * log.interval
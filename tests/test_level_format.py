@@ -0,0 +1,113 @@
+import os
+import struct
+
+import pytest
+
+SOURCE = """\
+# A small level
+width 3000
+start 50 400
+flag 2800 230
+
+ground 0 550 2200 50
+block 160 400 star
+brick 192 400
+pipe 1100 470 80
+coin 900 300
+goomba 1500 518
+"""
+
+def write_source(tmp_path, text=SOURCE, name="small"):
+    path = tmp_path / (name + ".level")
+    path.write_text(text)
+    return str(path)
+
+def test_parse_reads_every_record_kind(mg):
+    level = mg.Level.parse(SOURCE, "small")
+    assert (level.width, level.start, level.flag) == (3000, (50, 400), (2800, 230))
+    assert level.records == [
+        (0, 0, 0, 550, 2200, 50),
+        (1, mg.BLOCK_ITEMS.index("star"), 160, 400, 0, 0),
+        (2, 0, 192, 400, 0, 0),
+        (3, 0, 1100, 470, 0, 80),
+        (4, 0, 900, 300, 0, 0),
+        (5, 0, 1500, 518, 0, 0),
+    ]
+
+@pytest.mark.parametrize("line, message", [
+    ("block 10 10 cake", "unknown item 'cake'"),
+    ("pipe 10 10", "expected X Y H"),
+    ("cloud 10 10", "unknown record"),
+])
+def test_parse_reports_the_bad_line(mg, line, message):
+    with pytest.raises(ValueError, match=f"small:3: bad .*{message}"):
+        mg.Level.parse("width 100\n\n" + line, "small")
+
+def test_binary_layout(mg):
+    level = mg.Level("tiny", 2048, (10, 20), (1800, 230),
+                     [(0, 0, 0, 550, 1040, 50), (4, 0, 1100, 300, 0, 0), (1, 2, 64, 400, 0, 0)])
+    data = level.compile(chunk_width=1024)
+    # Ground crossing the chunk edge is split on its 16px tiling; chunks keep build order
+    records = [(0, 0, 0, 550, 1024, 50), (1, 2, 64, 400, 0, 0),
+               (0, 0, 1024, 550, 16, 50), (4, 0, 1100, 300, 0, 0)]
+    expected = b"".join([
+        struct.pack("<4sHxxiiiiiiii", b"MLVL", 2, 2048, 10, 20, 1800, 230, 4, 1024, 2),
+        struct.pack("<II", 0, 2),
+        struct.pack("<II", 2, 2),
+        *(struct.pack("<BBxxiiii", *record) for record in records),
+    ])
+    assert data == expected
+    assert mg.read_level_header(data) == {
+        "width": 2048, "start": (10, 20), "flag": (1800, 230),
+        "count": 4, "chunk_width": 1024, "chunks": 2,
+    }
+
+def test_compile_unpack_round_trip(mg):
+    level = mg.Level.parse(SOURCE, "small")
+    back = mg.Level.unpack(level.compile(), "small")
+    assert (back.width, back.start, back.flag) == (level.width, level.start, level.flag)
+    assert back.records == [record for chunk in level.chunked() for record in chunk]
+
+def test_header_rejects_other_formats(mg):
+    data = mg.Level.parse(SOURCE).compile()
+    with pytest.raises(ValueError, match="not a version 2 compiled level"):
+        mg.read_level_header(b"XXXX" + data[4:])
+    with pytest.raises(ValueError, match="not a version 2 compiled level"):
+        mg.read_level_header(data[:4] + struct.pack("<H", 1) + data[6:])
+
+def test_load_compiles_only_when_stale(mg, tmp_path):
+    source = write_source(tmp_path)
+    compiled = source[:-len(".level")] + ".levelc"
+    assert not mg.compiled_is_fresh(source)
+
+    level = mg.Level.load(source)
+    assert level.name == "small"
+    assert mg.compiled_is_fresh(source)
+    with open(compiled, "rb") as f:
+        assert f.read() == mg.Level.parse(SOURCE, "small").compile()
+
+    # A newer source makes the binary stale
+    os.utime(compiled, (1, 1))
+    assert not mg.compiled_is_fresh(source)
+    mg.Level.load(source)
+    assert mg.compiled_is_fresh(source)
+
+    # So does a binary in an older format
+    with open(compiled, "r+b") as f:
+        f.seek(4)
+        f.write(struct.pack("<H", 1))
+    assert not mg.compiled_is_fresh(source)
+    assert mg.Level.load(source).records == level.records
+
+def test_shipped_levels_compile(mg):
+    for name in mg.level_names():
+        source, _, _ = mg.level_paths(name)
+        with open(source) as f:
+            level = mg.Level.parse(f.read(), name)
+        back = mg.Level.unpack(level.compile(), name)
+        assert back.records == [record for chunk in level.chunked() for record in chunk]
+        # Splitting ground at chunk edges covers exactly the same ground
+        assert (sum(w for kind, _, _, _, w, _ in back.records if kind == 0) ==
+                sum(w for kind, _, _, _, w, _ in level.records if kind == 0))
+        assert (sorted(record for record in back.records if record[0]) ==
+                sorted(record for record in level.records if record[0]))
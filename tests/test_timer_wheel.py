@@ -0,0 +1,94 @@
+import random
+import types
+
+def advance(wheel, steps):
+    for _ in range(steps):
+        wheel.advance()
+
+def test_timers_fire_on_their_step_through_every_level(mg):
+    wheel = mg.TimerWheel()
+    fired = []
+    slots = mg.WHEEL_SLOTS
+    delays = [1, 2, slots - 1, slots, slots + 1, slots * slots - 1, slots * slots,
+              slots * slots + 1, 5000, slots ** 3 - 1]
+    for delay in delays:
+        wheel.schedule(delay, lambda delay=delay: fired.append((delay, wheel.now)))
+    advance(wheel, slots ** 3)
+    assert fired == [(delay, delay) for delay in sorted(delays)]
+
+def test_timers_beyond_the_wheel_cascade_again(mg):
+    wheel = mg.TimerWheel()
+    fired = []
+    delay = mg.WHEEL_SLOTS ** 3 + 1000
+    wheel.schedule(delay, lambda: fired.append(wheel.now))
+    advance(wheel, delay + 1)
+    assert fired == [delay]
+
+def test_random_timers_from_any_start_match_their_due_step(mg):
+    rng = random.Random(23)
+    start = rng.randrange(100000)
+    wheel = mg.TimerWheel(start)
+    due = {}
+    fired = {}
+    
+    def schedule(delay):
+        index = len(due)
+        due[index] = wheel.now + delay
+        wheel.schedule(delay, lambda: fired.__setitem__(index, wheel.now))
+    
+    for _ in range(500):
+        schedule(rng.choice([rng.randrange(1, 70), rng.randrange(1, 5000), rng.randrange(1, 20000)]))
+    # More scheduled mid-run, from wherever the wheel has got to
+    for _ in range(3000):
+        wheel.advance()
+        if rng.random() < 0.1:
+            schedule(rng.randrange(1, 5000))
+    advance(wheel, 20000)
+    assert fired == due
+
+def test_cancel_and_reschedule(mg):
+    wheel = mg.TimerWheel()
+    fired = []
+    first = wheel.schedule(10, fired.append, "first")
+    assert wheel.remaining(first) == 10
+    second = wheel.reschedule(first, 100, fired.append, "second")
+    wheel.cancel(wheel.schedule(5, fired.append, "cancelled"))
+    # A zero delay still waits for the next step
+    wheel.schedule(0, fired.append, "next")
+
+    advance(wheel, 99)
+    assert fired == ["next"]
+    assert wheel.remaining(first) == 0
+    assert wheel.remaining(second) == 1
+    wheel.advance()
+    assert fired == ["next", "second"]
+    assert wheel.remaining(second) == 0
+
+def test_rearm_restores_pending_timers_after_clear(mg):
+    wheel = mg.TimerWheel()
+    fired = []
+    owner = types.SimpleNamespace()
+    owner.soon = wheel.schedule(3, fired.append, "soon")
+    owner.late = wheel.schedule(200, fired.append, "late")
+    advance(wheel, 2)
+
+    # What a checkpoint restore does: forget every timer, then put back the owners'
+    wheel.clear(wheel.now)
+    wheel.rearm(owner)
+    # Rearming twice leaves a timer in the wheel twice; it still fires once
+    wheel.rearm(owner)
+    advance(wheel, 300)
+    assert fired == ["soon", "late"]
+
+    wheel.release(owner)
+    assert not owner.soon.armed and not owner.late.armed
+
+def test_durations_are_frames_at_any_rate(mg):
+    wheel = mg.TimerWheel(rate=2 * mg.FPS)
+    fired = []
+    timer = wheel.schedule(mg.CLOCK_FRAMES, lambda: fired.append(wheel.now))
+    wheel.advance()
+    assert wheel.remaining(timer) == mg.CLOCK_FRAMES  # 119 steps is 59.5 frames, rounded up
+    advance(wheel, 2 * mg.CLOCK_FRAMES)
+    assert fired == [2 * mg.CLOCK_FRAMES]
+    assert wheel.frame == mg.CLOCK_FRAMES